@@ -1,20 +1,41 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Query, BackgroundTasks
 from pydantic import BaseModel, ConfigDict
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime
-from sqlalchemy.orm import declarative_base, sessionmaker
-from typing import List, Optional
+from sqlalchemy import event, inspect, select, update, text, func, Column, Integer, String, Float, Date, DateTime
+from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import List, Optional, Tuple
 import datetime
+import functools
 import os
+import numpy as np
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
 import yfinance as yf
 from fastapi.middleware.cors import CORSMiddleware
-import subprocess
-import sys
+from fastapi.responses import ORJSONResponse, JSONResponse, Response, StreamingResponse
+import orjson
+import msgspec
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.decorator import cache
+from contextlib import asynccontextmanager
+import asyncio
+import background_updater
 import requests
+from requests.adapters import HTTPAdapter
 
 # --- Configuration ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_FILE = os.getenv('DB_FILE_PATH', os.path.join(BASE_DIR, 'finance.db'))
-DATABASE_URL = f"sqlite:///{DB_FILE}"
+DATABASE_URL = f"sqlite+aiosqlite:///{DB_FILE}"
+# Upper bound for a single Yahoo Finance round-trip inside a request
+YAHOO_TIMEOUT = 5.0
+# Optional: share the response cache across API workers (e.g. redis://localhost:6379/0)
+REDIS_URL = os.getenv('REDIS_URL')
 
 # --- Database Setup (Mirroring app.py) ---
 Base = declarative_base()
@@ -22,33 +43,43 @@ Base = declarative_base()
 class Asset(Base):
     __tablename__ = 'assets'
     id = Column(Integer, primary_key=True)
-    owner = Column(String, nullable=False, default="Vivek")
+    owner = Column(String, nullable=False, default="Vivek", index=True)
     name = Column(String, nullable=False)
     dp_name = Column(String, nullable=True)
     asset_type = Column(String, nullable=False)
     currency = Column(String, nullable=False)
     quantity = Column(Float, nullable=False)
     unit_price = Column(Float, nullable=False)
-    isin = Column(String, nullable=True)
-    ticker = Column(String, nullable=True)
+    isin = Column(String, nullable=True, index=True)
+    ticker = Column(String, nullable=True, index=True)
     last_updated = Column(DateTime, nullable=True)
     original_currency = Column(String, nullable=True)
     original_unit_price = Column(Float, nullable=True)
     daily_change_pct = Column(Float, nullable=True)
     avg_buy_price = Column(Float, nullable=True)
     price_30d = Column(Float, nullable=True)
+    # Transactions are linked by name + owner (no FK), matching how app.py cleans them up on delete.
+    # selectin keeps any select(Asset) to one extra IN query instead of a lazy load per asset,
+    # which the async session could not do implicitly anyway.
+    transactions = relationship(
+        "TransactionHistory",
+        primaryjoin="and_(foreign(TransactionHistory.asset_name) == Asset.name, "
+                    "foreign(TransactionHistory.owner) == Asset.owner)",
+        viewonly=True,
+        lazy="selectin"
+    )
 
 class PortfolioHistory(Base):
     __tablename__ = 'portfolio_history'
     id = Column(Integer, primary_key=True)
-    date = Column(Date, nullable=False)
+    date = Column(Date, nullable=False, index=True)
     total_value = Column(Float, nullable=False)
 
 class TransactionHistory(Base):
     __tablename__ = 'investment_transactions'
     id = Column(Integer, primary_key=True)
     asset_name = Column(String, nullable=False)
-    date = Column(Date, nullable=False)
+    date = Column(Date, nullable=False, index=True)
     ticker = Column(String, nullable=True)
     quantity_change = Column(Float, nullable=False)
     price_per_unit = Column(Float, nullable=False)
@@ -64,9 +95,54 @@ class PortfolioChangeHistory(Base):
     monthly_change_value = Column(Float, nullable=True)
     monthly_change_percent = Column(Float, nullable=True)
 
-engine = create_engine(DATABASE_URL, connect_args={'timeout': 30})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base.metadata.create_all(bind=engine)
+# Keep a warm pool of SQLite connections so requests don't reopen the db/wal/shm files each time
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=10,
+    max_overflow=20,
+    pool_pre_ping=True,
+    connect_args={'timeout': 30, 'check_same_thread': False}
+)
+
+@event.listens_for(engine.sync_engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL;")
+    cursor.execute("PRAGMA synchronous=NORMAL;")
+    cursor.execute("PRAGMA temp_store=MEMORY;")
+    cursor.execute("PRAGMA cache_size=-64000;")
+    cursor.close()
+
+BACKFILL_INDEXES = (
+    ('ix_assets_owner', 'assets', 'owner'),
+    ('ix_assets_ticker', 'assets', 'ticker'),
+    ('ix_assets_isin', 'assets', 'isin'),
+    ('ix_portfolio_history_date', 'portfolio_history', 'date'),
+    ('ix_investment_transactions_date', 'investment_transactions', 'date'),
+)
+INDEX_STATEMENTS = [
+    f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})" for name, table, column in BACKFILL_INDEXES
+]
+
+def schema_is_current(conn) -> bool:
+    """Read-only check that every mapped table and backfilled index already exists."""
+    inspector = inspect(conn)
+    tables = set(inspector.get_table_names())
+    if any(name not in tables for name in Base.metadata.tables):
+        return False
+    indexes = {
+        idx['name']
+        for table in {table for _, table, _ in BACKFILL_INDEXES}
+        for idx in inspector.get_indexes(table)
+    }
+    return all(name in indexes for name, _, _ in BACKFILL_INDEXES)
+
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
 
 # --- Pydantic Models (For API Responses) ---
 class PriceUpdateRequest(BaseModel):
@@ -115,6 +191,46 @@ class AssetSchema(BaseModel):
     original_currency: Optional[str]
     original_unit_price: Optional[float]
 
+class AssetRecord(msgspec.Struct):
+    """
+    Wire format for asset list responses (same fields as AssetSchema, which stays as the documented model).
+    Field order matches ASSET_COLUMNS so rows can be unpacked positionally.
+    """
+    id: int
+    owner: str
+    name: str
+    dp_name: Optional[str]
+    asset_type: str
+    currency: str
+    quantity: float
+    unit_price: float
+    isin: Optional[str]
+    ticker: Optional[str]
+    last_updated: Optional[datetime.datetime]
+    avg_buy_price: Optional[float]
+    price_30d: Optional[float]
+    original_currency: Optional[str]
+    original_unit_price: Optional[float]
+    current_value_inr: float = 0.0
+    day_price_diff: float = 0.0
+    day_total_diff: float = 0.0
+    day_percent_change: float = 0.0
+
+class MsgspecJSONResponse(JSONResponse):
+    # Subclasses JSONResponse so fastapi-cache stores the rendered body as-is
+    def render(self, content) -> bytes:
+        return msgspec.json.encode(content)
+
+class AssetMetricsSchema(BaseModel):
+    id: int
+    name: str
+    owner: str
+    current_value_inr: float
+    day_price_diff: float
+    day_total_diff: float
+    overall_gain_loss_inr: Optional[float]
+    overall_gain_loss_pct: Optional[float]
+
 class HistorySchema(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
@@ -143,111 +259,279 @@ class PortfolioChangeHistorySchema(BaseModel):
     monthly_change_percent: Optional[float]
 
 # --- Helpers ---
-def resolve_ticker_from_yahoo(query):
+# Shared HTTP session so Yahoo lookups reuse TCP/TLS connections
+_YF_SESSION = requests.Session()
+_YF_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=50))
+_YF_SESSION.headers.update({'User-Agent': 'Mozilla/5.0'})
+
+@functools.lru_cache(maxsize=256)
+def _search_yahoo_symbol(query: str, day: datetime.date) -> Optional[str]:
+    # 'day' only scopes the cache entry; HTTP errors raise so they are never cached
     url = f"https://query2.finance.yahoo.com/v1/finance/search?q={query}"
-    headers = {'User-Agent': 'Mozilla/5.0'}
+    r = _YF_SESSION.get(url, timeout=5)
+    r.raise_for_status()
+    quotes = r.json().get('quotes', [])
+    if not quotes: return None
+    for q in quotes:
+        symbol = q.get('symbol', '')
+        if symbol.endswith(('.NS', '.BO')):
+            return symbol
+    return quotes[0].get('symbol')
+
+def resolve_ticker_from_yahoo(query: str) -> Optional[str]:
     try:
-        r = requests.get(url, headers=headers, timeout=5)
-        if r.status_code == 200:
-            data = r.json()
-            quotes = data.get('quotes', [])
-            if not quotes: return None
-            for q in quotes:
-                symbol = q.get('symbol', '')
-                if symbol.endswith('.NS') or symbol.endswith('.BO'):
-                    return symbol
-            return quotes[0].get('symbol')
+        return _search_yahoo_symbol(query, datetime.date.today())
     except Exception:
         return None
-    return None
 
-def get_exchange_rate(from_currency):
+@functools.lru_cache(maxsize=32)
+def _fetch_exchange_rate(from_currency: str, day: datetime.date) -> float:
+    # 'day' only scopes the cache entry; failures raise so they are never cached
+    symbol = "GBPINR=X" if from_currency == 'GBp' else f"{from_currency}INR=X"
+    return yf.Ticker(symbol).history(period="1d")['Close'].iloc[-1]
+
+def get_exchange_rate(from_currency: str) -> float:
     if from_currency == 'INR': return 1.0
-    if from_currency == 'GBp':
-        try:
-            return yf.Ticker("GBPINR=X").history(period="1d")['Close'].iloc[-1]
-        except: return 1.0
     try:
-        return yf.Ticker(f"{from_currency}INR=X").history(period="1d")['Close'].iloc[-1]
+        return _fetch_exchange_rate(from_currency, datetime.date.today())
     except: return 1.0
 
+# --- Response Cache ---
+def request_key_builder(func, namespace="", *, request=None, response=None, args=(), kwargs=None):
+    # Key on the URL only; the injected DB session would otherwise make every key unique
+    return f"{namespace}:{request.url.path}?{request.url.query}"
+
+async def clear_response_cache(namespace: Optional[str] = None) -> None:
+    try:
+        await FastAPICache.clear(namespace)
+    except Exception as e:
+        print(f"Could not clear response cache: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Only take the write transaction for DDL when the schema is actually missing something,
+    # so workers starting against an existing DB don't queue up on SQLite's write lock
+    needs_ddl = not os.path.exists(DB_FILE)
+    if not needs_ddl:
+        async with engine.connect() as conn:
+            needs_ddl = not await conn.run_sync(schema_is_current)
+    if needs_ddl:
+        # create_all is sync-only, so run it through the async engine's connection
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            # create_all only indexes the tables it creates, so backfill indexes on existing DBs
+            for stmt in INDEX_STATEMENTS:
+                await conn.execute(text(stmt))
+
+    if REDIS_URL:
+        from redis import asyncio as aioredis
+        from fastapi_cache.backends.redis import RedisBackend
+        FastAPICache.init(RedisBackend(aioredis.from_url(REDIS_URL)), prefix="nw-cache")
+    else:
+        FastAPICache.init(InMemoryBackend(), prefix="nw-cache")
+
+    await asyncio.to_thread(warm_metrics_kernels)
+    yield
+
 # --- FastAPI App ---
-app = FastAPI(title="Finance Portfolio API", version="1.2.0")
+app = FastAPI(title="Finance Portfolio API", version="1.2.0", lifespan=lifespan, default_response_class=ORJSONResponse)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
-def process_asset_details(asset: Asset) -> AssetSchema:
-    schema = AssetSchema.model_validate(asset)
-    schema.current_value_inr = asset.quantity * asset.unit_price
-    if asset.daily_change_pct is not None:
-        schema.day_percent_change = asset.daily_change_pct
-        prev_price = asset.unit_price / (1 + (asset.daily_change_pct / 100))
-        schema.day_price_diff = asset.unit_price - prev_price
-        schema.day_total_diff = schema.day_price_diff * asset.quantity
-    return schema
+# Columns needed to build AssetSchema (daily_change_pct feeds the derived fields)
+ASSET_COLUMNS = (
+    Asset.id, Asset.owner, Asset.name, Asset.dp_name, Asset.asset_type, Asset.currency,
+    Asset.quantity, Asset.unit_price, Asset.isin, Asset.ticker, Asset.last_updated,
+    Asset.avg_buy_price, Asset.price_30d, Asset.original_currency, Asset.original_unit_price,
+    Asset.daily_change_pct
+)
+
+# Read-only endpoints select just the schema columns and return plain dicts (no ORM identity map)
+HISTORY_COLUMNS = (PortfolioHistory.date, PortfolioHistory.total_value)
+TRANSACTION_COLUMNS = (
+    TransactionHistory.id, TransactionHistory.asset_name, TransactionHistory.date, TransactionHistory.ticker,
+    TransactionHistory.quantity_change, TransactionHistory.price_per_unit, TransactionHistory.total_amount,
+    TransactionHistory.owner
+)
+CHANGE_COLUMNS = (
+    PortfolioChangeHistory.date, PortfolioChangeHistory.daily_change_value, PortfolioChangeHistory.daily_change_percent,
+    PortfolioChangeHistory.monthly_change_value, PortfolioChangeHistory.monthly_change_percent
+)
+
+# --- Portfolio Math ---
+# Array inputs use NaN for missing daily_change_pct / avg_buy_price.
+# Returns (current_value, day_price_diff, day_total_diff, gain_inr, gain_pct); gains are NaN without a buy price.
+PARALLEL_METRICS_THRESHOLD = 10_000
+
+def _metrics_kernel(quantity, unit_price, pct, avg_buy):
+    # Explicit loops so Numba can compile this to a single fused pass
+    n = quantity.shape[0]
+    current_value = np.empty(n)
+    day_price_diff = np.zeros(n)
+    day_total_diff = np.zeros(n)
+    gain_inr = np.full(n, np.nan)
+    gain_pct = np.full(n, np.nan)
+    for i in prange(n):
+        current_value[i] = quantity[i] * unit_price[i]
+        if not np.isnan(pct[i]):
+            prev_price = unit_price[i] / (1.0 + pct[i] / 100.0)
+            day_price_diff[i] = unit_price[i] - prev_price
+            day_total_diff[i] = day_price_diff[i] * quantity[i]
+        if avg_buy[i] > 0:
+            gain_inr[i] = (unit_price[i] - avg_buy[i]) * quantity[i]
+            gain_pct[i] = ((unit_price[i] - avg_buy[i]) / avg_buy[i]) * 100
+    return current_value, day_price_diff, day_total_diff, gain_inr, gain_pct
+
+def _metrics_numpy(quantity, unit_price, pct, avg_buy):
+    # Fallback when numba isn't installed: the same math as whole-array ops
+    has_pct = ~np.isnan(pct)
+    has_buy = avg_buy > 0
+    current_value = quantity * unit_price
+    with np.errstate(divide='ignore', invalid='ignore'):
+        day_price_diff = np.where(has_pct, unit_price - unit_price / (1.0 + pct / 100.0), 0.0)
+        gain_inr = np.where(has_buy, (unit_price - avg_buy) * quantity, np.nan)
+        gain_pct = np.where(has_buy, ((unit_price - avg_buy) / avg_buy) * 100, np.nan)
+    return current_value, day_price_diff, day_price_diff * quantity, gain_inr, gain_pct
+
+if njit is not None:
+    # error_model='numpy' turns a -100% change into inf instead of raising ZeroDivisionError
+    _metrics_jit = njit(cache=True, error_model='numpy')(_metrics_kernel)
+    _metrics_jit_parallel = njit(cache=True, error_model='numpy', parallel=True)(_metrics_kernel)
+
+def warm_metrics_kernels() -> None:
+    # Compiles (or loads from numba's on-disk cache) both variants for the float64 signature the
+    # endpoints use, so the first metrics request doesn't pay for the JIT. Blocking; run it off the event loop.
+    if njit is None:
+        return
+    sample = np.ones(1)
+    _metrics_jit(sample, sample, sample, sample)
+    _metrics_jit_parallel(sample, sample, sample, sample)
+
+def compute_metrics(quantity: np.ndarray, unit_price: np.ndarray, pct: np.ndarray, avg_buy: np.ndarray) -> Tuple[np.ndarray, ...]:
+    if njit is None:
+        return _metrics_numpy(quantity, unit_price, pct, avg_buy)
+    if quantity.shape[0] >= PARALLEL_METRICS_THRESHOLD:
+        return _metrics_jit_parallel(quantity, unit_price, pct, avg_buy)
+    return _metrics_jit(quantity, unit_price, pct, avg_buy)
+
+ASSET_COLUMN_INDEX = {col.key: i for i, col in enumerate(ASSET_COLUMNS)}
+
+def asset_arrays(rows) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Transpose once into column tuples instead of per-row attribute lookups; None -> NaN
+    columns = tuple(zip(*rows))
+    return (
+        np.array(columns[ASSET_COLUMN_INDEX['quantity']], dtype=float),
+        np.array(columns[ASSET_COLUMN_INDEX['unit_price']], dtype=float),
+        np.array(columns[ASSET_COLUMN_INDEX['daily_change_pct']], dtype=float),
+        np.array(columns[ASSET_COLUMN_INDEX['avg_buy_price']], dtype=float)
+    )
+
+def process_asset_details(rows) -> List[AssetRecord]:
+    """
+    Computes the derived value/day-change fields for a batch of asset rows in one pass.
+    """
+    if not rows:
+        return []
+
+    quantity, unit_price, pct, avg_buy = asset_arrays(rows)
+    current_value, day_price_diff, day_total_diff, _, _ = compute_metrics(quantity, unit_price, pct, avg_buy)
+    day_percent_change = np.where(np.isnan(pct), 0.0, pct)
+
+    # Rows come straight from typed columns, so build structs without validation.
+    # row[:-1] drops daily_change_pct, the last entry in ASSET_COLUMNS.
+    return [
+        AssetRecord(*row[:-1], cv, dpd, dtd, dpc)
+        for row, cv, dpd, dtd, dpc in zip(
+            rows, current_value.tolist(), day_price_diff.tolist(),
+            day_total_diff.tolist(), day_percent_change.tolist()
+        )
+    ]
+
+def fetch_latest_quote(ticker: str) -> Tuple[float, float, str]:
+    """
+    Returns (current_price, prev_close, currency) from Yahoo Finance. Blocking; run it off the event loop.
+    """
+    ticker_obj = yf.Ticker(ticker)
+    hist = ticker_obj.history(period="5d")
+    if hist.empty:
+        raise Exception("No price history found.")
+
+    current_price = hist['Close'].iloc[-1]
+    prev_close = hist['Close'].iloc[-2] if len(hist) >= 2 else current_price
+    currency = ticker_obj.fast_info.get('currency', 'INR')
+    return current_price, prev_close, currency
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Welcome to the Finance Portfolio API. Go to /docs for Swagger UI."}
 
-@app.get("/api/v1/assets", response_model=List[AssetSchema])
-def get_all_assets():
-    session = SessionLocal()
-    assets = session.query(Asset).all()
-    results = [process_asset_details(asset) for asset in assets]
-    session.close()
-    return results
-
-@app.get("/api/v1/assets/{owner}", response_model=List[AssetSchema])
-def get_assets_by_owner(owner: str):
-    session = SessionLocal()
-    assets = session.query(Asset).filter(Asset.owner == owner).all()
-    if not assets:
+# Asset lists are built as trusted msgspec structs, so skip FastAPI's response_model re-validation
+# and keep the schema for the docs only.
+@app.get("/api/v1/assets", response_model=None, responses={200: {"model": List[AssetSchema]}})
+@cache(expire=60, namespace="assets", key_builder=request_key_builder)
+async def get_all_assets(db: AsyncSession = Depends(get_db)):
+    rows = (await db.execute(select(*ASSET_COLUMNS))).all()
+    return MsgspecJSONResponse(process_asset_details(rows))
+
+@app.get("/api/v1/portfolio/metrics", response_model=None, responses={200: {"model": List[AssetMetricsSchema]}})
+async def get_portfolio_metrics(db: AsyncSession = Depends(get_db)):
+    """
+    Recomputes value, day-change and gain/loss for every asset in one batch.
+    """
+    rows = (await db.execute(select(*ASSET_COLUMNS))).all()
+    if not rows:
+        return ORJSONResponse([])
+
+    current_value, day_price_diff, day_total_diff, gain_inr, gain_pct = compute_metrics(*asset_arrays(rows))
+    # orjson writes NaN as null, which is what a missing buy price should be
+    return ORJSONResponse([
+        {
+            'id': asset_id, 'name': name, 'owner': owner,
+            'current_value_inr': cv, 'day_price_diff': dpd, 'day_total_diff': dtd,
+            'overall_gain_loss_inr': gi, 'overall_gain_loss_pct': gp
+        }
+        for (asset_id, owner, name, *_), cv, dpd, dtd, gi, gp in zip(
+            rows, current_value.tolist(), day_price_diff.tolist(), day_total_diff.tolist(),
+            gain_inr.tolist(), gain_pct.tolist()
+        )
+    ])
+
+@app.get("/api/v1/assets/{owner}", response_model=None, responses={200: {"model": List[AssetSchema]}})
+async def get_assets_by_owner(owner: str, db: AsyncSession = Depends(get_db)):
+    rows = (await db.execute(select(*ASSET_COLUMNS).where(Asset.owner == owner))).all()
+    if not rows:
         raise HTTPException(status_code=404, detail=f"No assets found for owner '{owner}'")
-    results = [process_asset_details(asset) for asset in assets]
-    session.close()
-    return results
+    return MsgspecJSONResponse(process_asset_details(rows))
 
 @app.post("/api/v1/assets/update-price", response_model=PriceUpdateResponse)
-def update_individual_asset_price(request: PriceUpdateRequest):
-    session = SessionLocal()
-    
+async def update_individual_asset_price(request: PriceUpdateRequest, db: AsyncSession = Depends(get_db)):
     # 1. Resolve Ticker
     target_ticker = request.ticker
     if not target_ticker and request.isin:
-        target_ticker = resolve_ticker_from_yahoo(request.isin)
+        try:
+            target_ticker = await asyncio.wait_for(
+                asyncio.to_thread(resolve_ticker_from_yahoo, request.isin), timeout=YAHOO_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            target_ticker = None
     
     if not target_ticker:
-        session.close()
         raise HTTPException(status_code=400, detail="A ticker or valid ISIN must be provided.")
 
-    # 2. Find matching assets in DB
-    query = session.query(Asset)
-    if request.ticker:
-        query = query.filter(Asset.ticker == request.ticker)
-    elif request.isin:
-        query = query.filter(Asset.isin == request.isin)
-    
-    assets = query.all()
-    if not assets:
-        session.close()
-        raise HTTPException(status_code=404, detail="No matching assets found in database.")
-
-    # 3. Fetch Price from Yahoo Finance
+    # 2. Fetch Price from Yahoo Finance (before touching the DB so no connection is held meanwhile)
     try:
-        ticker_obj = yf.Ticker(target_ticker)
-        hist = ticker_obj.history(period="5d")
-        if hist.empty:
-            raise Exception("No price history found.")
-        
-        current_price = hist['Close'].iloc[-1]
-        prev_close = hist['Close'].iloc[-2] if len(hist) >= 2 else current_price
-        currency = ticker_obj.fast_info.get('currency', 'INR')
+        current_price, prev_close, currency = await asyncio.wait_for(
+            asyncio.to_thread(fetch_latest_quote, target_ticker), timeout=YAHOO_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Yahoo Finance Error: timed out after {YAHOO_TIMEOUT}s")
     except Exception as e:
-        session.close()
         raise HTTPException(status_code=500, detail=f"Yahoo Finance Error: {e}")
 
-    # 4. Currency Conversion
-    rate = get_exchange_rate(currency)
+    # 3. Currency Conversion
+    try:
+        rate = await asyncio.wait_for(asyncio.to_thread(get_exchange_rate, currency), timeout=YAHOO_TIMEOUT)
+    except asyncio.TimeoutError:
+        rate = 1.0
     if currency == 'GBp':
         price_inr = (current_price / 100) * rate
     elif currency != 'INR':
@@ -255,23 +539,38 @@ def update_individual_asset_price(request: PriceUpdateRequest):
     else:
         price_inr = current_price
 
-    # 5. Update Database Records
+    # 4. Find matching assets in DB
+    query = select(Asset.id, Asset.name, Asset.owner, Asset.quantity, Asset.unit_price, Asset.avg_buy_price)
+    if request.ticker:
+        query = query.where(Asset.ticker == request.ticker)
+    elif request.isin:
+        query = query.where(Asset.isin == request.isin)
+    
+    assets = (await db.execute(query)).all()
+    if not assets:
+        raise HTTPException(status_code=404, detail="No matching assets found in database.")
+
+    # 5. Update Database Records (every matching row gets the same values, so one UPDATE covers them)
+    daily_change_pct = None
+    new_values = {
+        'unit_price': price_inr,
+        'original_unit_price': current_price,
+        'original_currency': currency,
+        'last_updated': datetime.datetime.now()
+    }
+    if prev_close > 0:
+        daily_change_pct = ((current_price - prev_close) / prev_close) * 100
+        new_values['daily_change_pct'] = daily_change_pct
+
+    await db.execute(
+        update(Asset).where(Asset.id.in_([a.id for a in assets])).values(**new_values)
+    )
+
     updates = []
     for asset in assets:
-        old_price = asset.unit_price
-        asset.unit_price = price_inr
-        asset.original_unit_price = current_price
-        asset.original_currency = currency
-        asset.last_updated = datetime.datetime.now()
-        
-        daily_change_pct = None
-        if prev_close > 0:
-            daily_change_pct = ((current_price - prev_close) / prev_close) * 100
-            asset.daily_change_pct = daily_change_pct
-        
         # Calculations for Response
         total_value = asset.quantity * price_inr
-        day_change_val = (price_inr - old_price) * asset.quantity
+        day_change_val = (price_inr - asset.unit_price) * asset.quantity
         
         overall_gain_inr = None
         overall_gain_pct = None
@@ -284,7 +583,7 @@ def update_individual_asset_price(request: PriceUpdateRequest):
             name=asset.name,
             owner=asset.owner,
             quantity=asset.quantity,
-            old_price_inr=old_price,
+            old_price_inr=asset.unit_price,
             new_price_inr=price_inr,
             total_value_inr=total_value,
             daily_change_pct=daily_change_pct,
@@ -293,8 +592,8 @@ def update_individual_asset_price(request: PriceUpdateRequest):
             overall_gain_loss_pct=overall_gain_pct
         ))
 
-    session.commit()
-    session.close()
+    await db.commit()
+    await clear_response_cache("assets")
 
     return PriceUpdateResponse(
         ticker=target_ticker,
@@ -303,46 +602,108 @@ def update_individual_asset_price(request: PriceUpdateRequest):
         updates=updates
     )
 
-@app.get("/api/v1/history", response_model=List[HistorySchema])
-def get_portfolio_history():
-    session = SessionLocal()
-    history = session.query(PortfolioHistory).order_by(PortfolioHistory.date).all()
-    session.close()
-    return history
-
-@app.get("/api/v1/transactions", response_model=List[TransactionHistorySchema])
-def get_transaction_history():
-    session = SessionLocal()
-    transactions = session.query(TransactionHistory).order_by(TransactionHistory.date.desc()).all()
-    session.close()
-    return transactions
-
-@app.get("/api/v1/changes", response_model=Optional[PortfolioChangeHistorySchema])
-def get_latest_change_summary():
+STREAM_BATCH_SIZE = 500
+
+async def stream_json_rows(query):
+    """
+    Yields `query`'s rows as a JSON array, fetching and encoding STREAM_BATCH_SIZE rows at a time.
+    Opens its own session because the response body is sent after request dependencies have closed.
+    """
+    async with SessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+        yield b"["
+        first = True
+        async for batch in result.mappings().partitions():
+            chunk = b",".join(orjson.dumps(dict(row)) for row in batch)
+            yield chunk if first else b"," + chunk
+            first = False
+        yield b"]"
+
+# Serialized payload of the unfiltered /history request -> (table fingerprint, JSON bytes).
+# Filtered requests are client-keyed, so they are never cached here.
+_history_cache = None
+
+@app.get("/api/v1/history", response_model=None, responses={200: {"model": List[HistorySchema]}})
+async def get_portfolio_history(
+    since: Optional[datetime.date] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Returns net worth history oldest-first. `since` filters by date; `limit` keeps the most recent N rows.
+    """
+    global _history_cache
+    cacheable = since is None and limit is None
+    if cacheable:
+        # The table only grows by a row a day (plus today's value being rewritten), so a cheap
+        # aggregate tells us whether the cached payload is still current.
+        fingerprint = tuple((await db.execute(
+            select(func.max(PortfolioHistory.date), func.count(), func.sum(PortfolioHistory.total_value))
+        )).one())
+        if _history_cache and _history_cache[0] == fingerprint:
+            return Response(content=_history_cache[1], media_type="application/json")
+
+    query = select(*HISTORY_COLUMNS).order_by(PortfolioHistory.date.desc())
+    if since:
+        query = query.where(PortfolioHistory.date >= since)
+    if limit:
+        query = query.limit(limit)
+    history = (await db.execute(query)).mappings().all()
+    payload = orjson.dumps([dict(h) for h in reversed(history)])
+    if cacheable:
+        _history_cache = (fingerprint, payload)
+    return Response(content=payload, media_type="application/json")
+
+@app.get("/api/v1/transactions", response_model=None, responses={200: {"model": List[TransactionHistorySchema]}})
+async def get_transaction_history(
+    since: Optional[datetime.date] = None,
+    limit: Optional[int] = Query(None, ge=1)
+):
+    query = select(*TRANSACTION_COLUMNS).order_by(TransactionHistory.date.desc())
+    if since:
+        query = query.where(TransactionHistory.date >= since)
+    if limit:
+        query = query.limit(limit)
+    return StreamingResponse(stream_json_rows(query), media_type="application/json")
+
+@app.get("/api/v1/changes", response_model=None, responses={200: {"model": PortfolioChangeHistorySchema}})
+@cache(expire=300, namespace="history", key_builder=request_key_builder)
+async def get_latest_change_summary(db: AsyncSession = Depends(get_db)):
     """
     Returns the most recent daily and monthly change summary from the history table.
     """
-    session = SessionLocal()
-    latest_change = session.query(PortfolioChangeHistory).order_by(PortfolioChangeHistory.date.desc()).first()
-    session.close()
+    latest_change = (await db.execute(select(*CHANGE_COLUMNS).order_by(PortfolioChangeHistory.date.desc()).limit(1))).mappings().first()
     if not latest_change:
         raise HTTPException(status_code=404, detail="No change history found. Run the background updater first.")
-    return latest_change
+    return ORJSONResponse(dict(latest_change))
 
-@app.get("/api/v1/changes/history", response_model=List[PortfolioChangeHistorySchema])
-def get_all_change_history():
+@app.get("/api/v1/changes/history", response_model=None, responses={200: {"model": List[PortfolioChangeHistorySchema]}})
+async def get_all_change_history(
+    since: Optional[datetime.date] = None,
+    limit: Optional[int] = Query(None, ge=1)
+):
     """
-    Returns the full history of daily and monthly portfolio changes.
+    Returns the history of daily and monthly portfolio changes, newest first.
+    Optional `since` (YYYY-MM-DD) and `limit` bound the result set.
     """
-    session = SessionLocal()
-    history = session.query(PortfolioChangeHistory).order_by(PortfolioChangeHistory.date.desc()).all()
-    session.close()
-    return history
+    query = select(*CHANGE_COLUMNS).order_by(PortfolioChangeHistory.date.desc())
+    if since:
+        query = query.where(PortfolioChangeHistory.date >= since)
+    if limit:
+        query = query.limit(limit)
+    return StreamingResponse(stream_json_rows(query), media_type="application/json")
+
+async def run_background_update():
+    # Same work as `background_updater.py --once`, but in-process and off the event loop
+    global _history_cache
+    await asyncio.to_thread(background_updater.update_prices)
+    _history_cache = None
+    await clear_response_cache()
 
 @app.post("/api/v1/trigger-background-job", status_code=202)
-def trigger_background_job():
+async def trigger_background_job(background_tasks: BackgroundTasks):
     try:
-        subprocess.Popen([sys.executable, "background_updater.py", "--once"])
+        background_tasks.add_task(run_background_update)
         return {"message": "Background update job triggered successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to trigger background job: {e}")
@@ -1,38 +1,67 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import sqlalchemy
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, text
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, Date, DateTime
 from sqlalchemy.orm import declarative_base, sessionmaker
-import plotly.express as px
 import time
 import json
 import datetime
 import yfinance as yf
 import os
 import re
-from streamlit_sortables import sort_items
-import subprocess
+import threading
 from groq import Groq
 import sys
+import sqlite3
 try:
     import casparser
 except ImportError:
     casparser = None
 
 import shutil
+import tempfile
 import time
+from market_data import run_parallel, progress_step, download_last_closes
 
 # --- Database Setup ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_FILE = os.getenv('DB_FILE_PATH', os.path.join(BASE_DIR, 'finance.db'))
 DATABASE_URL = f"sqlite:///{DB_FILE}"
 
+def copy_sqlite_database(src, dst):
+    # SQLite's online backup API copies page by page under SQLite's own locking, so the copy
+    # includes pages still in the WAL and the live database never has to be closed
+    src_conn = sqlite3.connect(src)
+    dst_conn = sqlite3.connect(dst)
+    try:
+        src_conn.backup(dst_conn)
+    finally:
+        dst_conn.close()
+        src_conn.close()
+
+@st.cache_data(ttl=30, show_spinner=False)
+def list_backups(db_dir, db_filename):
+    """Backup file names for db_filename (e.g. finance.db.2023...bak) in db_dir, newest first."""
+    # Cached so Settings reruns don't rescan the directory; backup_database() clears it
+    with os.scandir(db_dir) as entries:
+        backups = [e.name for e in entries if e.name.startswith(f"{db_filename}.") and e.name.endswith('.bak')]
+    backups.sort(reverse=True) # Newest first
+    return backups
+
 def backup_database():
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     backup_file = f"{DB_FILE}.{timestamp}.bak"
     try:
-        shutil.copy2(DB_FILE, backup_file)
+        copy_sqlite_database(DB_FILE, backup_file)
+        list_backups.clear()
         return backup_file
     except Exception as e:
         print(f"Error creating backup: {e}")
@@ -43,15 +72,15 @@ Base = declarative_base()
 class Asset(Base):
     __tablename__ = 'assets'
     id = Column(Integer, primary_key=True)
-    owner = Column(String, nullable=False, default="Vivek")
+    owner = Column(String, nullable=False, default="Vivek", index=True)
     name = Column(String, nullable=False)
     dp_name = Column(String, nullable=True)
     asset_type = Column(String, nullable=False)
     currency = Column(String, nullable=False)
     quantity = Column(Float, nullable=False)
     unit_price = Column(Float, nullable=False)
-    isin = Column(String, nullable=True)
-    ticker = Column(String, nullable=True)
+    isin = Column(String, nullable=True, index=True)
+    ticker = Column(String, nullable=True, index=True)
     last_updated = Column(DateTime, nullable=True)
     original_currency = Column(String, nullable=True)
     original_unit_price = Column(Float, nullable=True)
@@ -62,7 +91,7 @@ class Asset(Base):
 class PortfolioHistory(Base):
     __tablename__ = 'portfolio_history'
     id = Column(Integer, primary_key=True)
-    date = Column(Date, nullable=False)
+    date = Column(Date, nullable=False, index=True)
     total_value = Column(Float, nullable=False)
 
 class AppSettings(Base):
@@ -86,7 +115,7 @@ class AppSettings(Base):
 class InvestmentTransaction(Base):
     __tablename__ = 'investment_transactions'
     id = Column(Integer, primary_key=True)
-    date = Column(Date, default=datetime.date.today)
+    date = Column(Date, default=datetime.date.today, index=True)
     asset_name = Column(String, nullable=False)
     ticker = Column(String, nullable=True)
     transaction_type = Column(String, default="BUY") # BUY, SELL, ADJUSTMENT
@@ -104,94 +133,74 @@ class PortfolioChangeHistory(Base):
     monthly_change_value = Column(Float, nullable=True)
     monthly_change_percent = Column(Float, nullable=True)
 
-# Increase timeout to 30s to handle concurrent writes (background updater + app)
-engine = create_engine(DATABASE_URL, connect_args={'timeout': 30})
+class TickerCache(Base):
+    __tablename__ = 'ticker_cache'
+    key = Column(String, primary_key=True) # ISIN or asset name as searched
+    symbol = Column(String, nullable=True) # NULL = Yahoo had no match
+    fetched_at = Column(DateTime, nullable=False)
 
-# Enable Write-Ahead Logging (WAL) for better concurrency
-try:
-    with engine.connect() as connection:
-        connection.execute(text("PRAGMA journal_mode=WAL;"))
-except Exception as e:
-    print(f"Could not set WAL mode: {e}")
+# SQLite allows one writer at a time, so the session engine holds a single connection and
+# Streamlit reruns queue for it instead of racing each other into SQLITE_BUSY.
+# Increase timeout to 30s to handle concurrent writes (background updater + app)
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={'timeout': 30, 'check_same_thread': False},
+    pool_size=1,
+    max_overflow=0,
+    pool_pre_ping=True
+)
+# Read-only dataframe loaders use their own pool; WAL lets them read alongside the writer
+read_engine = create_engine(DATABASE_URL, connect_args={'timeout': 30, 'check_same_thread': False}, pool_pre_ping=True)
+
+# Per-connection pragmas: WAL + busy_timeout so writes from the background updater wait instead of failing
+@event.listens_for(engine, "connect")
+@event.listens_for(read_engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL;")
+    cursor.execute("PRAGMA synchronous=NORMAL;")
+    cursor.execute("PRAGMA busy_timeout=30000;")
+    cursor.execute("PRAGMA temp_store=MEMORY;")
+    cursor.execute("PRAGMA cache_size=-64000;")
+    cursor.execute("PRAGMA mmap_size=268435456;")
+    cursor.close()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Columns added after the first release: (table, column, DDL type)
+INIT_DB_MIGRATIONS = [
+    ('app_settings', 'gemini_api_key', "VARCHAR"),
+    ('app_settings', 'groq_api_key', "VARCHAR"),
+    ('app_settings', 'ai_context_columns', "VARCHAR DEFAULT 'name,ticker,quantity,unit_price,Value (INR),daily_change_pct'"),
+    ('app_settings', 'gotify_url', "VARCHAR"),
+    ('app_settings', 'gotify_token', "VARCHAR"),
+    ('app_settings', 'gotify_enabled', "BOOLEAN DEFAULT 0"),
+    ('assets', 'price_30d', "FLOAT"),
+]
+
 @st.cache_resource
 def init_db():
+    # create_all also covers tables added later (investment_transactions, portfolio_change_history)
     Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        # One PRAGMA table_info per table instead of probing each column with a failing SELECT
+        existing = {}
+        for table, col, type_ in INIT_DB_MIGRATIONS:
+            if table not in existing:
+                existing[table] = {r[1] for r in conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()}
+            if col not in existing[table]:
+                try:
+                    conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {col} {type_}")
+                    existing[table].add(col)
+                except Exception as e:
+                    print(f"Error adding {table}.{col}: {e}")
+
     session = SessionLocal()
-    
     # Check if settings exist
     if not session.query(AppSettings).first():
         session.add(AppSettings(id=1))
         session.commit()
-    
-    # Schema Migration: Check if gemini_api_key exists
-    try:
-        session.execute(sqlalchemy.text("SELECT gemini_api_key FROM app_settings LIMIT 1"))
-    except Exception:
-        try:
-            session.execute(sqlalchemy.text("ALTER TABLE app_settings ADD COLUMN gemini_api_key VARCHAR"))
-            session.commit()
-        except: pass
-
-    # Migration: groq_api_key
-    try:
-        session.execute(sqlalchemy.text("SELECT groq_api_key FROM app_settings LIMIT 1"))
-    except Exception:
-        try:
-            session.execute(sqlalchemy.text("ALTER TABLE app_settings ADD COLUMN groq_api_key VARCHAR"))
-            session.commit()
-        except: pass
-
-    # Migration: ai_context_columns
-    try:
-        session.execute(sqlalchemy.text("SELECT ai_context_columns FROM app_settings LIMIT 1"))
-    except Exception:
-        try:
-            default_cols = "name,ticker,quantity,unit_price,Value (INR),daily_change_pct"
-            session.execute(sqlalchemy.text(f"ALTER TABLE app_settings ADD COLUMN ai_context_columns VARCHAR DEFAULT '{default_cols}'"))
-            session.commit()
-        except: pass
-
-    # Migration: Gotify
-    try:
-        session.execute(sqlalchemy.text("SELECT gotify_url FROM app_settings LIMIT 1"))
-    except Exception:
-        try:
-            session.execute(sqlalchemy.text("ALTER TABLE app_settings ADD COLUMN gotify_url VARCHAR"))
-            session.execute(sqlalchemy.text("ALTER TABLE app_settings ADD COLUMN gotify_token VARCHAR"))
-            session.execute(sqlalchemy.text("ALTER TABLE app_settings ADD COLUMN gotify_enabled BOOLEAN DEFAULT 0"))
-            session.commit()
-        except: pass
-
-    # Migration: price_30d
-    try:
-        session.execute(sqlalchemy.text("SELECT price_30d FROM assets LIMIT 1"))
-    except Exception:
-        try:
-            session.execute(sqlalchemy.text("ALTER TABLE assets ADD COLUMN price_30d FLOAT"))
-            session.commit()
-        except: pass
-
-    # Migration: InvestmentTransaction table
-    try:
-        session.execute(sqlalchemy.text("SELECT * FROM investment_transactions LIMIT 1"))
-    except Exception:
-        try:
-            Base.metadata.create_all(bind=engine) # Re-run create_all to be sure
-        except: pass
-        
-    # Migration: PortfolioChangeHistory table
-    try:
-        session.execute(sqlalchemy.text("SELECT * FROM portfolio_change_history LIMIT 1"))
-    except Exception:
-        try:
-            # Explicitly create the single table if it's missing
-            PortfolioChangeHistory.__table__.create(bind=engine, checkfirst=True)
-        except Exception as e_create:
-            print(f"Error creating portfolio_change_history table: {e_create}")
-
     session.close()
 
 def get_db_session():
@@ -261,23 +270,105 @@ ISIN_MAP = {
     "INE538L01033": "DOMS.NS"
 }
 
-def resolve_ticker_from_yahoo(query):
+# Mutual fund / ETF ISINs that Yahoo search can't resolve; these override any stored ticker on import
+MF_ISIN_MAP = {
+    "INF204KB17I5": "GOLDBEES.NS",
+    "INF789F01XA0": "0P0000XVU2.BO",
+}
+ISIN_MAP.update(MF_ISIN_MAP)
+
+TICKER_CACHE_MAX_AGE = datetime.timedelta(days=90)
+
+# What a Yahoo/yfinance lookup raises for an unknown symbol, missing data or a network problem.
+# OSError covers ConnectionError/timeouts and curl_cffi's RequestException, which newer yfinance
+# raises instead of requests'.
+YAHOO_ERRORS = (requests.RequestException, OSError, KeyError, IndexError, ValueError, TypeError)
+try:
+    from yfinance.exceptions import YFException
+    YAHOO_ERRORS += (YFException,)
+except ImportError:
+    pass
+
+# Symbols whose price lookup just failed are not retried until this long has passed
+FAILED_TICKER_COOLDOWN = datetime.timedelta(minutes=10)
+
+@st.cache_resource
+def get_failed_tickers():
+    # {symbol: retry_after}; a resource so it survives reruns and st.cache_data.clear()
+    return {}
+
+@st.cache_resource
+def get_yahoo_session():
+    # Cached as a resource so the pooled keep-alive connections survive Streamlit reruns
+    session = requests.Session()
+    retries = Retry(total=2, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504))
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries))
+    session.headers.update({'User-Agent': 'Mozilla/5.0'})
+    return session
+
+@st.cache_resource
+def get_groq_client(api_key):
+    # One client (and its keep-alive HTTP pool) per key, reused across chat turns and reruns
+    return Groq(api_key=api_key)
+
+def search_yahoo_symbol(query):
+    """
+    Queries Yahoo search, preferring NSE/BSE listings.
+    Returns the symbol or None for no match; raises on network/HTTP errors.
+    """
     url = f"https://query2.finance.yahoo.com/v1/finance/search?q={query}"
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    try:
-        r = requests.get(url, headers=headers, timeout=5)
-        if r.status_code == 200:
-            data = r.json()
-            quotes = data.get('quotes', [])
-            if not quotes: return None
-            for q in quotes:
-                symbol = q.get('symbol', '')
-                if symbol.endswith('.NS') or symbol.endswith('.BO'):
-                    return symbol
-            return quotes[0].get('symbol')
-    except Exception:
-        return None
-    return None
+    r = get_yahoo_session().get(url, timeout=5)
+    r.raise_for_status()
+    quotes = r.json().get('quotes', [])
+    if not quotes: return None
+    for q in quotes:
+        symbol = q.get('symbol', '')
+        if symbol.endswith(('.NS', '.BO')):
+            return symbol
+    return quotes[0].get('symbol')
+
+def resolve_tickers_from_yahoo(queries, on_progress=None):
+    """
+    Resolves ISINs/names to Yahoo symbols through the ticker_cache table; returns {query: symbol or None}.
+    Cache misses are searched concurrently. Lookups (including misses) are reused for
+    TICKER_CACHE_MAX_AGE; network errors are not cached.
+    Takes the writer session only to store new lookups, so don't call it while holding one.
+    """
+    queries = {q for q in queries if q}
+    resolved = {}
+    cutoff = datetime.datetime.now() - TICKER_CACHE_MAX_AGE
+    if queries:
+        with read_engine.connect() as conn:
+            cached = conn.execute(
+                sqlalchemy.select(TickerCache.key, TickerCache.symbol)
+                .where(TickerCache.key.in_(queries), TickerCache.fetched_at >= cutoff)
+            )
+            resolved.update(cached.tuples())
+
+    to_fetch = [q for q in queries if q not in resolved]
+    # Network calls run on worker threads with no connection checked out
+    fetched = run_parallel(search_yahoo_symbol, to_fetch, on_progress=on_progress)
+    now = datetime.datetime.now()
+    new_entries = []
+    for query, (symbol, error) in fetched.items():
+        if error is None:
+            new_entries.append(TickerCache(key=query, symbol=symbol, fetched_at=now))
+        resolved[query] = symbol
+    if new_entries:
+        with SessionLocal() as session:
+            for entry in new_entries:
+                session.merge(entry)
+            session.commit()
+    return resolved
+
+# cache_resource rather than cache_data: price syncs call st.cache_data.clear(), which would
+# throw the rates away on exactly the runs that need them. Failures raise, so they aren't cached.
+@st.cache_resource(ttl=3600, show_spinner=False)
+def fetch_fx_close(symbol):
+    hist = yf.Ticker(symbol).history(period="1d")
+    if hist.empty:
+        raise ValueError(f"No FX data for {symbol}")
+    return float(hist['Close'].iloc[-1])
 
 def get_exchange_rate(from_currency):
     """
@@ -286,38 +377,29 @@ def get_exchange_rate(from_currency):
     if from_currency == 'INR':
         return 1.0
     
-    # Handle pence
-    if from_currency == 'GBp':
-        try:
-            ticker = yf.Ticker("GBPINR=X")
-            hist = ticker.history(period="1d")
-            if not hist.empty:
-                return hist['Close'].iloc[-1]
-        except:
-            pass
-        return 1.0 # Fallback
-
+    # Handle pence: the GBP rate applies, callers divide by 100
+    pair = 'GBP' if from_currency == 'GBp' else from_currency
     try:
         # Standard pairs: USDINR=X, EURINR=X
-        symbol = f"{from_currency}INR=X"
-        ticker = yf.Ticker(symbol)
-        hist = ticker.history(period="1d")
-        if not hist.empty:
-            return hist['Close'].iloc[-1]
-    except:
-        pass
-    
-    return 1.0
+        return fetch_fx_close(f"{pair}INR=X")
+    except YAHOO_ERRORS as e:
+        print(f"FX rate for {from_currency} unavailable, using 1.0: {e}")
+        return 1.0 # Fallback
+
+# Trailing corporate suffixes, stripped in one pass (repeats handle e.g. "INDIA PVT LTD")
+_SUFFIX_RE = re.compile(
+    r'(?:\s+(?:LIMITED|LTD|PVT|PRIVATE|NEW EQUITY SHARES|EQUITY SHARES|S\.A\.|INC|CORPORATION|CORP|INDIA))+$',
+    re.IGNORECASE
+)
+_NAME_SPLIT_RE = re.compile(r'[#-]')
 
 def guess_ticker(name, isin):
-    if isin and isin.strip() in ISIN_MAP: return ISIN_MAP[isin.strip()]
+    if isin:
+        mapped = ISIN_MAP.get(isin.strip())
+        if mapped: return mapped
     if not name: return None
-    clean_name = name.upper()
-    if "#" in clean_name: clean_name = clean_name.split("#")[0]
-    if "-" in clean_name: clean_name = clean_name.split("-")[0]
-    for suffix in [" LIMITED", " LTD", " PVT", " PRIVATE", " EQUITY SHARES", " S.A.", " INC", " CORP", " CORPORATION", " INDIA", " NEW EQUITY SHARES", " EQUITY SHARES"]:
-        clean_name = clean_name.replace(suffix, "")
-    clean_name = clean_name.strip()
+    clean_name = _NAME_SPLIT_RE.split(name.upper(), maxsplit=1)[0]
+    clean_name = _SUFFIX_RE.sub('', clean_name.rstrip()).strip()
     if clean_name:
         first_word = clean_name.split(' ')[0]
         if len(first_word) > 2: return f"{first_word}.NS"
@@ -333,6 +415,7 @@ def clear_all_data():
     st.cache_data.clear()
 
 def parse_and_load_json(json_content, owner_name, auto_fill_tickers=True):
+    session = None
     try:
         # 1. Backup Database
         bkp = backup_database()
@@ -344,8 +427,6 @@ def parse_and_load_json(json_content, owner_name, auto_fill_tickers=True):
         else:
             data = json.loads(json_content)
         
-        session = SessionLocal()
-        
         # 2. Fetch Existing State (Before Deletion) for History Calculation
         # Map by ISIN (primary) and Name (secondary fallback)
         # We must AGGREGATE existing holdings because the DB might currently contain duplicates.
@@ -355,31 +436,25 @@ def parse_and_load_json(json_content, owner_name, auto_fill_tickers=True):
         # Helper to normalize names for matching
         def normalize(n): return n.strip().lower() if n else ""
         
-        current_db_assets = session.query(Asset).filter(Asset.owner == owner_name).all()
-        for asset in current_db_assets:
-            # Aggregate by ISIN
-            if asset.isin:
-                if asset.isin not in existing_assets_map:
-                    existing_assets_map[asset.isin] = {'quantity': 0.0, 'ticker': asset.ticker}
-                existing_assets_map[asset.isin]['quantity'] += asset.quantity
-                # Keep the first non-null ticker found
-                if not existing_assets_map[asset.isin]['ticker'] and asset.ticker:
-                    existing_assets_map[asset.isin]['ticker'] = asset.ticker
-            
-            # Aggregate by Name (Fallback)
-            norm_name = normalize(asset.name)
+        # SQLite sums the holdings per ISIN and per name; MAX(ticker) picks a non-empty ticker if any
+        # (TRIM/LOWER match normalize() for the ASCII names CAS files contain)
+        # Read on the read engine; the single writer connection is only taken for the final write
+        norm_col = sqlalchemy.func.lower(sqlalchemy.func.trim(Asset.name))
+        with read_engine.connect() as conn:
+            by_isin = conn.execute(
+                sqlalchemy.select(Asset.isin, sqlalchemy.func.sum(Asset.quantity), sqlalchemy.func.max(Asset.ticker))
+                .where(Asset.owner == owner_name, Asset.isin.isnot(None), Asset.isin != '').group_by(Asset.isin)
+            ).all()
+            by_name = conn.execute(
+                sqlalchemy.select(norm_col, sqlalchemy.func.sum(Asset.quantity), sqlalchemy.func.max(Asset.ticker))
+                .where(Asset.owner == owner_name).group_by(norm_col)
+            ).all()
+        for isin, qty, ticker in by_isin:
+            existing_assets_map[isin] = {'quantity': qty or 0.0, 'ticker': ticker or None}
+        for norm_name, qty, ticker in by_name:
             if norm_name:
-                if norm_name not in existing_assets_by_name:
-                    existing_assets_by_name[norm_name] = {'quantity': 0.0, 'ticker': asset.ticker}
-                existing_assets_by_name[norm_name]['quantity'] += asset.quantity
-                if not existing_assets_by_name[norm_name]['ticker'] and asset.ticker:
-                     existing_assets_by_name[norm_name]['ticker'] = asset.ticker
-
-        # 3. Snapshot Strategy: Delete existing assets for this owner
-        # This prevents duplicates and ensures the portfolio matches the imported file exactly.
-        # We delete AFTER fetching state, so we can still diff.
-        session.query(Asset).filter(Asset.owner == owner_name).delete()
-        
+                existing_assets_by_name[norm_name] = {'quantity': qty or 0.0, 'ticker': ticker or None}
+
         updated_count = 0
         added_count = 0
         transactions_logged = 0
@@ -431,15 +506,10 @@ def parse_and_load_json(json_content, owner_name, auto_fill_tickers=True):
                     add_to_aggregate(s.get('name'), 'MF', float(s.get('units',0)), float(s.get('value',0)), s.get('isin'), dp_name=amc)
         
         # --- PROCESS AGGREGATED ITEMS ---
-        # Special MF Ticker map
-        ISIN_MAP_HARDCODED = {
-            "INE674K01013": "ABCAPITAL.NS",
-            "INE009A01021": "INFY.NS",
-            "INE467B01029": "TCS.NS",
-            "INE040A01034": "HDFCBANK.NS",
-            "INF204KB17I5": "GOLDBEES.NS",
-            "INF789F01XA0": "0P0000XVU2.BO",
-        }
+        asset_rows = []
+        trans_rows = []
+        today = datetime.date.today()
+        now = datetime.datetime.now()
 
         for key, item in aggregated_holdings.items():
             name = item['name']
@@ -456,99 +526,124 @@ def parse_and_load_json(json_content, owner_name, auto_fill_tickers=True):
             prev_ticker = None
             
             # Lookup in aggregated existing state
+            norm_name = normalize(name)
             if isin and isin in existing_assets_map:
                 prev_qty = existing_assets_map[isin]['quantity']
                 prev_ticker = existing_assets_map[isin]['ticker']
-            elif normalize(name) in existing_assets_by_name:
-                prev_qty = existing_assets_by_name[normalize(name)]['quantity']
-                prev_ticker = existing_assets_by_name[normalize(name)]['ticker']
+            elif norm_name in existing_assets_by_name:
+                prev_qty = existing_assets_by_name[norm_name]['quantity']
+                prev_ticker = existing_assets_by_name[norm_name]['ticker']
+
+            # Resolve the ticker once; the transaction log and the new asset share it
+            ticker = None
+            if prev_ticker:
+                 ticker = prev_ticker # Preserve ticker from DB
+            elif auto_fill_tickers and type_ == 'Stock':
+                ticker = guess_ticker(name, isin)
+            
+            if type_ == 'MF' and isin:
+                ticker = ISIN_MAP.get(isin, ticker)
             
             # Calculate Change
             qty_diff = qty - prev_qty
             
             # Log Transaction if significant increase (BUY)
             if qty_diff > 0.001:
-                hist_ticker = prev_ticker
-                if not hist_ticker and auto_fill_tickers and type_ == 'Stock':
-                     hist_ticker = guess_ticker(name, isin)
-                
-                if type_ == 'MF' and isin in ISIN_MAP_HARDCODED:
-                    hist_ticker = ISIN_MAP_HARDCODED[isin]
+                hist_ticker = ticker
 
                 invested_amt = qty_diff * unit_price
                 
-                trans = InvestmentTransaction(
-                    date=datetime.date.today(),
-                    asset_name=name,
-                    ticker=hist_ticker,
-                    transaction_type="BUY",
-                    quantity_change=qty_diff,
-                    price_per_unit=unit_price,
-                    total_amount=invested_amt,
-                    owner=owner_name
-                )
-                session.add(trans)
+                trans_rows.append({
+                    'date': today,
+                    'asset_name': name,
+                    'ticker': hist_ticker,
+                    'transaction_type': "BUY",
+                    'quantity_change': qty_diff,
+                    'price_per_unit': unit_price,
+                    'total_amount': invested_amt,
+                    'owner': owner_name
+                })
                 transactions_logged += 1
 
             # --- CREATE NEW ASSET (Aggregated) ---
-            ticker = None
-            if prev_ticker:
-                 ticker = prev_ticker # Preserve ticker from DB
-            elif auto_fill_tickers and type_ == 'Stock':
-                ticker = guess_ticker(name, isin)
-            
-            if type_ == 'MF' and isin in ISIN_MAP_HARDCODED:
-                ticker = ISIN_MAP_HARDCODED[isin]
-            
-            new_asset = Asset(
-                owner=owner_name,
-                name=name,
-                dp_name=dp_name,
-                asset_type=type_,
-                currency='INR',
-                quantity=qty,
-                unit_price=unit_price,
-                isin=isin,
-                ticker=ticker,
-                last_updated=datetime.datetime.now()
-            )
-            session.add(new_asset)
+            asset_rows.append({
+                'owner': owner_name,
+                'name': name,
+                'dp_name': dp_name,
+                'asset_type': type_,
+                'currency': 'INR',
+                'quantity': qty,
+                'unit_price': unit_price,
+                'isin': isin,
+                'ticker': ticker,
+                'last_updated': now
+            })
             added_count += 1
 
+        # 3. Snapshot Strategy: Delete existing assets for this owner and insert the imported set
+        # in one transaction. This prevents duplicates and ensures the portfolio matches the
+        # imported file exactly; the old state was read above, so we can still diff.
+        session = SessionLocal()
+        session.execute(sqlalchemy.delete(Asset).where(Asset.owner == owner_name))
+        # Plain mappings are inserted in executemany batches, skipping per-object unit-of-work state
+        if asset_rows:
+            session.bulk_insert_mappings(Asset, asset_rows)
+        if trans_rows:
+            session.bulk_insert_mappings(InvestmentTransaction, trans_rows)
         session.commit()
-        session.close()
         st.cache_data.clear()
         return True, f"Data processed! Assets (Aggregated): {added_count}, Transactions Logged: {transactions_logged}"
     except Exception as e:
         return False, str(e)
+    finally:
+        # The session engine has a single connection, so release it on the error path too
+        if session is not None:
+            session.close()
 
 # --- Price Updates ---
 
 def auto_populate_tickers_smart():
-    session = SessionLocal()
-    assets = session.query(Asset).filter((Asset.ticker == None) | (Asset.ticker == ''), Asset.isin.isnot(None)).all()
-    count = 0
+    # Plain rows from the read engine; the Yahoo searches run without holding the writer connection
+    with read_engine.connect() as conn:
+        assets = conn.execute(
+            sqlalchemy.select(Asset.id, Asset.isin, Asset.name)
+            .where((Asset.ticker == None) | (Asset.ticker == ''), Asset.isin.isnot(None))
+        ).all()
     progress_bar = st.progress(0)
-    total = len(assets)
-    for i, asset in enumerate(assets):
-        found_ticker = resolve_ticker_from_yahoo(asset.isin)
-        if not found_ticker: found_ticker = resolve_ticker_from_yahoo(asset.name)
+
+    # Search every ISIN first, then fall back to names only for the ISINs Yahoo didn't know
+    by_isin = resolve_tickers_from_yahoo([a.isin for a in assets],
+                                         on_progress=lambda done, total: progress_bar.progress(done / total * 0.5))
+    unresolved = [a for a in assets if not by_isin.get(a.isin)]
+    by_name = resolve_tickers_from_yahoo([a.name for a in unresolved],
+                                         on_progress=lambda done, total: progress_bar.progress(0.5 + done / total * 0.5))
+
+    updates = []
+    for asset in assets:
+        found_ticker = by_isin.get(asset.isin) or by_name.get(asset.name)
         if found_ticker:
-            asset.ticker = found_ticker
-            count += 1
-        if total > 0: progress_bar.progress((i + 1) / total)
-    session.commit()
-    session.close()
+            updates.append({'id': asset.id, 'ticker': found_ticker})
+    progress_bar.progress(1.0)
+    if updates:
+        with SessionLocal() as session:
+            session.bulk_update_mappings(Asset, updates)
+            session.commit()
     st.cache_data.clear()
-    return count
+    return len(updates)
 
 def update_prices_from_yfinance():
-    session = SessionLocal()
-    assets = session.query(Asset).filter(Asset.ticker.isnot(None)).all()
+    # Plain rows from the read engine, not ORM objects: all Yahoo I/O happens with no connection
+    # checked out, and results are written back with one bulk UPDATE on the writer session.
+    with read_engine.connect() as conn:
+        priced = conn.execute(
+            sqlalchemy.select(Asset.id, Asset.ticker, Asset.original_currency).where(Asset.ticker.isnot(None))
+        ).all()
+    updates = []
     updated_count = 0
     progress_bar = st.progress(0)
-    total = len(assets)
-    
+    total = len(priced)
+    step = progress_step(total)
+
     # Cache rates to speed up
     rates_cache = {
         'INR': 1.0,
@@ -556,41 +651,47 @@ def update_prices_from_yfinance():
         'GBP': get_exchange_rate('GBP'),
         'EUR': get_exchange_rate('EUR')
     }
-    
-    for i, asset in enumerate(assets):
+
+    # One batched download for every ticker instead of a history() round-trip per asset
+    tickers = sorted({a.ticker.strip() for a in priced if a.ticker.strip()})
+    closes = download_last_closes(tickers)
+    # Ticker objects are only used for currency/info lookups, created lazily
+    yf_tickers = yf.Tickers(" ".join(tickers)).tickers if tickers else {}
+    get_ticker = lambda symbol: yf_tickers.get(symbol) or yf.Ticker(symbol)
+
+    # The remaining per-symbol calls (currency for never-priced assets, .info for symbols missing
+    # from the batch download) are network-bound, so they run concurrently before the loop.
+    # Currency rarely changes, so the one stored on the last update is reused.
+    need_currency = sorted({a.ticker.strip() for a in priced if a.ticker.strip() and not a.original_currency})
+    failed_tickers = get_failed_tickers()
+    now = datetime.datetime.now()
+    need_info = [t for t in tickers if t not in closes and failed_tickers.get(t, now) <= now]
+    currencies = run_parallel(lambda t: get_ticker(t).fast_info.get('currency', 'INR'), need_currency)
+    infos = run_parallel(lambda t: get_ticker(t).info, need_info)
+
+    for i, asset in enumerate(priced):
         if asset.ticker and asset.ticker.strip():
             try:
-                ticker = yf.Ticker(asset.ticker)
-                price = None
-                prev_close = None
-                currency = 'INR'
+                symbol = asset.ticker.strip()
+                price, prev_close = closes.get(symbol, (None, None))
 
-                # Try to get currency
-                try:
-                    currency = ticker.fast_info.get('currency', 'INR')
-                except:
-                    pass
-                
-                # Try getting fast history first
-                hist = ticker.history(period="5d") # Fetch a few days to be safe
-                if not hist.empty:
-                    price = hist['Close'].iloc[-1]
-                    if len(hist) >= 2:
-                        prev_close = hist['Close'].iloc[-2]
-                
-                # Fallback to info if history fails or is insufficient
+                currency = asset.original_currency or currencies.get(symbol, (None, None))[0] or 'INR'
+            
+                # Fallback to info only for symbols missing from the batch download
                 if not price:
-                    info = ticker.info
+                    if symbol not in infos:
+                        raise LookupError(f"{symbol} failed recently, retry after {failed_tickers[symbol]:%H:%M}")
+                    info, error = infos[symbol]
+                    if error: raise error
+                    info = info or {}
                     price = info.get('currentPrice') or info.get('regularMarketPrice')
                     prev_close = info.get('previousClose') or info.get('regularMarketPreviousClose')
-                    if not currency and 'currency' in info:
-                        currency = info['currency']
 
                 if price and price > 0:
                     # --- CURRENCY CONVERSION ---
                     native_price = price
                     price_inr = price
-                    
+                
                     # Handle GBp (Pence) specially
                     if currency == 'GBp':
                         rate = rates_cache.get('GBP', 1.0)
@@ -602,33 +703,46 @@ def update_prices_from_yfinance():
                             rates_cache[currency] = rate
                         price_inr = native_price * rate
 
-                    asset.unit_price = price_inr
-                    asset.original_unit_price = native_price
-                    asset.original_currency = currency
-                    asset.last_updated = datetime.datetime.now()
-                    
+                    row = {
+                        'id': asset.id,
+                        'unit_price': price_inr,
+                        'original_unit_price': native_price,
+                        'original_currency': currency,
+                        'last_updated': datetime.datetime.now()
+                    }
+                
                     # Calculate Daily Change %
                     if prev_close and prev_close > 0:
-                        change = ((price - prev_close) / prev_close) * 100
-                        asset.daily_change_pct = change
-                        
+                        row['daily_change_pct'] = ((price - prev_close) / prev_close) * 100
+                    
+                    updates.append(row)
                     updated_count += 1
+                    failed_tickers.pop(symbol, None)
                 else:
-                    asset.last_updated = None # Set blank if price not found
-            except Exception:
-                asset.last_updated = None # Set blank if error
-        if total > 0: progress_bar.progress((i + 1) / total)
-                
-    session.commit()
-    session.close()
+                    updates.append({'id': asset.id, 'last_updated': None}) # Set blank if price not found
+                    failed_tickers[symbol] = now + FAILED_TICKER_COOLDOWN
+            except YAHOO_ERRORS + (LookupError,) as e:
+                print(f"Price update failed for {asset.ticker}: {e}")
+                updates.append({'id': asset.id, 'last_updated': None}) # Set blank if error
+                failed_tickers.setdefault(symbol, now + FAILED_TICKER_COOLDOWN)
+        if (i + 1) % step == 0 or i + 1 == total: progress_bar.progress((i + 1) / total)
+
+    if updates:
+        with SessionLocal() as session:
+            session.bulk_update_mappings(Asset, updates)
+            session.commit()
     st.cache_data.clear()
     return updated_count
 
 # --- History ---
 
 def record_portfolio_value(total_value):
-    session = SessionLocal()
+    # Streamlit reruns the script on every widget interaction; only write when today's value moved
     today = datetime.date.today()
+    recorded = (today, round(float(total_value), 2))
+    if st.session_state.get('history_recorded') == recorded:
+        return
+    session = SessionLocal()
     entry = session.query(PortfolioHistory).filter(PortfolioHistory.date == today).first()
     if entry:
         entry.total_value = total_value
@@ -637,21 +751,260 @@ def record_portfolio_value(total_value):
         session.add(entry)
     session.commit()
     session.close()
-
-@st.cache_data(ttl=3600) # Cache history for 1 hour as it's daily
+    st.session_state.history_recorded = recorded
+
+# Statements are built once; pandas runs them straight on the read engine, no ORM session needed
+HISTORY_QUERY = sqlalchemy.select(PortfolioHistory)
+# Value (INR) is computed by SQLite alongside the row instead of in pandas afterwards
+ASSETS_QUERY = sqlalchemy.select(Asset, (Asset.quantity * Asset.unit_price).label('Value (INR)'))
+# Net worth and today's value change in one aggregate; the daily term is the same
+# price * pct / (100 + pct) used for the per-row columns, with unknown % counting as no change
+_DAILY_PCT = sqlalchemy.func.coalesce(Asset.daily_change_pct, 0.0)
+PORTFOLIO_TOTALS_QUERY = sqlalchemy.select(
+    sqlalchemy.func.coalesce(sqlalchemy.func.sum(Asset.quantity * Asset.unit_price), 0.0),
+    sqlalchemy.func.coalesce(sqlalchemy.func.sum(Asset.quantity * Asset.unit_price * _DAILY_PCT / (100.0 + _DAILY_PCT)), 0.0),
+)
+TRANSACTIONS_QUERY = sqlalchemy.select(InvestmentTransaction)
+
+# The app's own write paths call st.cache_data.clear(). History is also written by
+# daily_email_report.generate_report (the scheduler, and the Send Test Email job, which clears
+# this cache when it finishes), so the TTL bounds how stale scheduled runs can leave it.
+@st.cache_data(ttl=300, show_spinner=False)
 def get_history_df():
-    # optimized to use global engine
-    return pd.read_sql(sessionmaker(bind=engine)().query(PortfolioHistory).statement, sessionmaker(bind=engine)().bind)
+    return pd.read_sql_query(HISTORY_QUERY, read_engine, parse_dates=['date'])
+
+def shrink_df(df, float_cols=(), category_cols=()):
+    """
+    Downcasts the given float columns and stores low-cardinality strings as category
+    (groupby on those columns should pass observed=True so filtered-out labels don't appear).
+    Money and quantity columns are left at float64 so net worth totals stay exact to the paisa.
+    """
+    for c in float_cols:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], downcast='float')
+    for c in category_cols:
+        if c in df.columns:
+            df[c] = df[c].astype('category')
+    return df
 
 @st.cache_data(ttl=10) # Cache assets for 10s to allow quick interactions without DB hits
 def get_assets_df():
-    # optimized to use global engine
-    return pd.read_sql(sessionmaker(bind=engine)().query(Asset).statement, sessionmaker(bind=engine)().bind)
+    df = pd.read_sql_query(ASSETS_QUERY, read_engine)
+    # Canonical ticker for grouping, computed once per load instead of on every rerun
+    df['ticker_norm'] = df['ticker'].fillna('').str.strip().str.upper()
+    # Display placeholders for the charts, also filled once per load
+    df['dp_name'] = df['dp_name'].fillna('Unknown')
+    df['asset_type'] = df['asset_type'].fillna('Other')
+    df['original_currency'] = df['original_currency'].fillna('INR')
+    return shrink_df(df, float_cols=['daily_change_pct'],
+                     category_cols=['owner', 'asset_type', 'currency', 'original_currency', 'dp_name'])
 
 @st.cache_data(ttl=10)
+def get_portfolio_totals():
+    """(total net worth, total daily value change) in INR, summed by SQLite."""
+    with read_engine.connect() as conn:
+        total_value, daily_change = conn.execute(PORTFOLIO_TOTALS_QUERY).one()
+    return float(total_value), float(daily_change)
+
+@st.cache_data(ttl=300, show_spinner=False)
 def get_transactions_df():
-    # optimized to use global engine
-    return pd.read_sql(sessionmaker(bind=engine)().query(InvestmentTransaction).statement, sessionmaker(bind=engine)().bind)
+    df = pd.read_sql_query(TRANSACTIONS_QUERY, read_engine, parse_dates=['date'])
+    return shrink_df(df, category_cols=['owner', 'transaction_type'])
+
+# --- Highlights ---
+
+MOVERS_COLUMNS = ['ticker_norm', 'name', 'quantity', 'unit_price', 'daily_change_pct', 'daily_total_value_change']
+
+def top_k_positions(arr, k, largest=True):
+    """
+    Positions of the k largest (or smallest) values, best first.
+    argpartition selects in O(n); only the k winners are then sorted.
+    """
+    k = min(k, arr.size)
+    if k == 0:
+        return np.empty(0, dtype=np.intp)
+    keys = -arr if largest else arr
+    idx = np.argpartition(keys, k - 1)[:k]
+    return idx[np.argsort(keys[idx], kind='stable')]
+
+@st.cache_data(show_spinner=False)
+def compute_daily_movers(movers_key, _movers_df):
+    """
+    Top/bottom 3 tickers by daily value and % change, summed across all owners.
+    Cached on movers_key only; the leading underscore keeps Streamlit from hashing the frame itself.
+    """
+    # Group by Ticker to sum quantities across ALL owners (Vivek, Wife, Father, etc.)
+    # This ensures Cipla holdings in all accounts are combined.
+    # Group order doesn't matter (top-k follows), so skip the key sort.
+    m_df = _movers_df[_movers_df['ticker_norm'] != '']
+    daily_grouped = m_df.groupby('ticker_norm', sort=False, observed=True).agg(
+        name=('name', 'first'),
+        quantity=('quantity', 'sum'),
+        unit_price=('unit_price', 'first'),
+        daily_change_pct=('daily_change_pct', 'first'), # All rows for same ticker have same % change
+        daily_change_value=('daily_total_value_change', 'sum') # Sum calculated value change
+    )
+
+    # Filter for assets with valid sync data
+    daily_active = daily_grouped[daily_grouped['daily_change_pct'].notna()]
+
+    # Each key is materialised once and shared by its top and bottom selection
+    values = daily_active['daily_change_value'].to_numpy(dtype=np.float64)
+    pcts = daily_active['daily_change_pct'].to_numpy(dtype=np.float64)
+    return (
+        daily_active.iloc[top_k_positions(values, 3)],
+        daily_active.iloc[top_k_positions(values, 3, largest=False)],
+        daily_active.iloc[top_k_positions(pcts, 3)],
+        daily_active.iloc[top_k_positions(pcts, 3, largest=False)],
+    )
+
+def render_metric_row(rows, label, value, delta):
+    """
+    One st.metric per row, laid out side by side in a single st.columns call.
+    label/value/delta are format strings filled from each row's fields, so no per-row Series is built.
+    """
+    records = rows.to_dict('records')
+    for col, rec in zip(st.columns(len(records)), records):
+        with col:
+            st.metric(label=label.format(**rec), value=value.format(**rec), delta=delta.format(**rec), delta_color="normal")
+
+# --- Growth ---
+
+def _growth_sums(up, qty, p30, ab):
+    """
+    Fused reduction for the Growth tab: sum((price - price_30d) * qty) and sum((price - avg_buy) * qty)
+    over rows with a positive reference price, plus how many rows had one.
+    """
+    monthly = 0.0
+    total = 0.0
+    n_30d = 0
+    n_buy = 0
+    for i in range(up.shape[0]):
+        q = qty[i]
+        u = up[i]
+        p = p30[i]
+        a = ab[i]
+        if p == p and p > 0.0: # p == p is False for NaN
+            monthly += (u - p) * q
+            n_30d += 1
+        if a == a and a > 0.0:
+            total += (u - a) * q
+            n_buy += 1
+    return monthly, total, n_30d, n_buy
+
+def _growth_sums_numpy(up, qty, p30, ab):
+    with np.errstate(invalid='ignore'):
+        valid_30d = p30 > 0 # NaN compares False
+        valid_buy = ab > 0
+    return (
+        float(np.nansum(np.where(valid_30d, (up - p30) * qty, 0.0))),
+        float(np.nansum(np.where(valid_buy, (up - ab) * qty, 0.0))),
+        int(valid_30d.sum()),
+        int(valid_buy.sum()),
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_growth_kernel():
+    # Compiled once per server process (the script itself re-runs on every interaction).
+    # fastmath without 'nnan', so the NaN checks in the loop are kept.
+    if njit is None:
+        return _growth_sums_numpy
+    kernel = njit(fastmath={'reassoc', 'contract', 'arcp'})(_growth_sums)
+    warm = np.zeros(1)
+    kernel(warm, warm, warm, warm)
+    return kernel
+
+# --- Analysis ---
+
+TREEMAP_PATH = ['owner', 'asset_type', 'dp_name', 'name']
+
+@st.cache_data(show_spinner=False)
+def build_treemap_figure(tree_key, _tree_df):
+    # Cached on tree_key (hash of the pre-aggregated leaves); the frame itself isn't hashed
+    import plotly.express as px
+    return px.treemap(
+        _tree_df, 
+        path=[px.Constant("Total Portfolio")] + TREEMAP_PATH, 
+        values='Value (INR)',
+        color='asset_type',
+        title='Hierarchical Portfolio View'
+    )
+
+# --- Daily Report ---
+
+def run_test_email(job):
+    """
+    Sends the daily report in-process (runs on a worker thread; only touches the plain `job` dict).
+    Falls back to running the script if the module can't be imported here.
+    """
+    try:
+        try:
+            from daily_email_report import send_report
+        except ImportError:
+            import subprocess
+            result = subprocess.run([sys.executable, "daily_email_report.py"], capture_output=True, text=True,
+                                    cwd=BASE_DIR, timeout=60)
+            job['message'] = result.stdout if result.returncode == 0 else result.stderr
+            job['status'] = 'done' if result.returncode == 0 else 'error'
+            return
+        job['message'] = send_report()
+        job['status'] = 'done'
+    except Exception as e:
+        job['message'] = str(e)
+        job['status'] = 'error'
+    finally:
+        # generate_report writes today's portfolio_history row
+        get_history_df.clear()
+
+# --- AI Insights ---
+
+DEFAULT_AI_CONTEXT_COLUMNS = "name,ticker,quantity,unit_price,Value (INR),daily_change_pct"
+
+def ai_context_columns(df):
+    """The columns chosen in Settings that exist in df, plus Value (INR) for the top-50 cut."""
+    cols = [c for c in st.session_state.ai_context_columns.split(",") if c in df.columns]
+    if 'Value (INR)' not in cols and 'Value (INR)' in df.columns:
+        cols.append('Value (INR)')
+    return cols
+
+@st.cache_data(show_spinner=False)
+def build_ai_context(ctx_key, _df):
+    """
+    CSV of the top 50 holdings for the chat system prompt. Cached on ctx_key, a fingerprint of the
+    projected df, so follow-up questions reuse the CSV until the portfolio changes.
+    """
+    # HARD LIMIT: top 50 by Value to prevent Token Limit Exceeded (nlargest avoids a full sort)
+    if 'Value (INR)' in _df.columns:
+        context_df = _df.nlargest(50, 'Value (INR)')
+    else:
+        context_df = _df.head(50)
+
+    # Convert to CSV string; floats are written with 2 decimals to save tokens, formatted by
+    # the CSV writer itself instead of a round() pass per column first
+    return context_df.to_csv(index=False, float_format='%.2f', lineterminator='\n')
+
+# Use Llama 3.3 70B on Groq (Current versatile model)
+AI_CHAT_MODEL = "llama-3.3-70b-versatile"
+
+@st.cache_data(ttl=600, show_spinner=False)
+def ask_groq(_client, model, system_instruction, prompt):
+    """
+    One chat completion. The same question over the same portfolio context within 10 minutes
+    is answered from the cache instead of another paid call; errors are not cached.
+    """
+    completion = _client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_instruction},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.5,
+        max_tokens=1024,
+        top_p=1,
+        stream=False,
+        stop=None,
+    )
+    return completion.choices[0].message.content
 
 # --- UI ---
 
@@ -666,16 +1019,18 @@ except Exception as e:
 
 init_db()
 
-# Initialize/Fetch API Key
-if "groq_api_key" not in st.session_state:
+# Initialize/Fetch API Key and AI context columns
+if "groq_api_key" not in st.session_state or "ai_context_columns" not in st.session_state:
     # Try to get from DB first
     session = SessionLocal()
-    settings = session.query(AppSettings).filter(AppSettings.id == 1).first()
+    settings = session.get(AppSettings, 1)
     db_key = settings.groq_api_key if settings else None
+    db_cols = settings.ai_context_columns if settings else None
     session.close()
     
     # Fallback to env var or empty
     st.session_state.groq_api_key = db_key or os.getenv("GROQ_API_KEY", "")
+    st.session_state.ai_context_columns = db_cols or DEFAULT_AI_CONTEXT_COLUMNS
 
 # Sidebar
 st.sidebar.title("Data Management")
@@ -683,6 +1038,7 @@ st.sidebar.title("Data Management")
 # Trigger Background Update Button
 if st.sidebar.button("🔄 Update Live Prices & AI Summary"):
     try:
+        import subprocess # only needed here, imported on click
         # Run background_updater.py with --once flag
         result = subprocess.Popen([sys.executable, "background_updater.py", "--once"])
         st.sidebar.success("Background update triggered! Check Gotify/Logs in a moment.")
@@ -719,24 +1075,25 @@ elif import_mode == "Upload CAS PDF":
         # Parse Button
         if uploaded_pdf and st.sidebar.button("1. Parse PDF", disabled=(not pdf_password)):
             with st.spinner("Parsing CAS PDF..."):
+                tmp_path = None
                 try:
-                    # Save temp file
-                    with open("temp_cas.pdf", "wb") as f:
-                        f.write(uploaded_pdf.getbuffer())
+                    # Stream the upload to a private temp file in 1MB chunks instead of copying the whole buffer
+                    uploaded_pdf.seek(0)
+                    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tf:
+                        shutil.copyfileobj(uploaded_pdf, tf, 1 << 20)
+                        tmp_path = tf.name
                     
                     # Parse
-                    data = casparser.read_cas_pdf("temp_cas.pdf", pdf_password, force_pdfminer=True)
+                    data = casparser.read_cas_pdf(tmp_path, pdf_password, force_pdfminer=True)
                     st.session_state['parsed_cas_data'] = data
                     st.sidebar.success("✅ Parsing Successful!")
-                    
-                    # Cleanup
-                    if os.path.exists("temp_cas.pdf"):
-                        os.remove("temp_cas.pdf")
                         
                 except Exception as e:
                     st.sidebar.error(f"Failed to parse PDF: {e}")
-                    if os.path.exists("temp_cas.pdf"):
-                        os.remove("temp_cas.pdf")
+                finally:
+                    # Cleanup
+                    if tmp_path and os.path.exists(tmp_path):
+                        os.remove(tmp_path)
 
         # Preview and Import
         if 'parsed_cas_data' in st.session_state and st.session_state['parsed_cas_data']:
@@ -783,14 +1140,16 @@ if not df.empty:
     # --- Global Calculations ---
     # Calculate per-unit daily price change & total value change
     if 'daily_change_pct' in df.columns:
-        df['daily_price_change'] = df['unit_price'] - (df['unit_price'] / (1 + (df['daily_change_pct'] / 100)))
-        df['daily_total_value_change'] = df['daily_price_change'] * df['quantity']
+        # price - price / (1 + pct/100) simplifies to price * pct / (100 + pct); unknown % counts as no change
+        pct = df['daily_change_pct'].fillna(0).to_numpy(dtype=np.float64)
+        daily_price_change = df['unit_price'].to_numpy() * pct / (100.0 + pct)
+        df['daily_price_change'] = daily_price_change
+        df['daily_total_value_change'] = daily_price_change * df['quantity'].to_numpy()
     else:
         df['daily_price_change'] = 0.0
         df['daily_total_value_change'] = 0.0
 
-    df['Value (INR)'] = df['quantity'] * df['unit_price']
-    total_net_worth = df['Value (INR)'].sum()
+    total_net_worth, total_daily_change = get_portfolio_totals()
     record_portfolio_value(total_net_worth)
     
     c1, c2, c3 = st.columns([1, 1, 1])
@@ -814,86 +1173,55 @@ if not df.empty:
             time.sleep(1)
             st.rerun()
 
-    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["Highlights", "Portfolio", "Analysis", "Growth Graph", "Settings", "AI Insights"])
+    # st.tabs runs every tab body on each rerun; a keyed radio only runs the visible one
+    # (and, being keyed, keeps the current view across st.rerun())
+    active_tab = st.radio("View", ["Highlights", "Portfolio", "Analysis", "Growth Graph", "Settings", "AI Insights"],
+                          horizontal=True, key='active_tab', label_visibility="collapsed")
     
-    with tab1:
+    if active_tab == "Highlights":
         st.header("✨ Daily Highlights & Movers")
         
         if not df.empty:
             # Prepare Data for Overall Change
             # Calculate overall pct change where buy price is available
             # Formula: (current - buy) / buy
-            # Create a copy to avoid SettingWithCopy warnings on main df
-            highlights_df = df.copy()
-            highlights_df['overall_change_pct'] = 0.0
-            
-            # Vectorized calculation where buy_price > 0
-            valid_buy = (highlights_df['avg_buy_price'].notna()) & (highlights_df['avg_buy_price'] > 0)
-            highlights_df.loc[valid_buy, 'overall_change_pct'] = (
-                (highlights_df.loc[valid_buy, 'unit_price'] - highlights_df.loc[valid_buy, 'avg_buy_price']) 
-                / highlights_df.loc[valid_buy, 'avg_buy_price']
-            ) * 100
+            # Kept as a local array: only the few overall movers need it as a column, so df isn't copied
+            # Single ufunc pass where buy_price > 0; other rows stay 0
+            ab = df['avg_buy_price'].to_numpy(dtype=np.float64)
+            up = df['unit_price'].to_numpy(dtype=np.float64)
+            valid_buy = np.isfinite(ab) & (ab > 0)
+            overall_change_pct = np.zeros_like(ab)
+            np.divide(up - ab, ab, out=overall_change_pct, where=valid_buy)
+            overall_change_pct *= 100.0
             
             # --- Daily Movers ---
             st.subheader("📅 Today's Top Movers (Family Total)")
             col_d1, col_d2 = st.columns(2)
             
-            # 1. Prepare global data for aggregation (ignore owner filter for Highlights)
-            # Use the full 'df' fetched from DB
-            m_df = df.copy()
-            m_df['ticker'] = m_df['ticker'].fillna('').str.strip().str.upper()
-            
-            # 2. Group by Ticker to sum quantities across ALL owners (Vivek, Wife, Father, etc.)
-            # This ensures Cipla holdings in all accounts are combined.
-            daily_grouped = m_df[m_df['ticker'] != ''].groupby('ticker', as_index=False).agg({
-                'name': 'first',
-                'quantity': 'sum',
-                'unit_price': 'first',
-                'daily_change_pct': 'first', # All rows for same ticker have same % change
-                'daily_total_value_change': 'sum' # Sum calculated value change
-            })
-            
-            # Rename for compatibility with downstream logic
-            daily_grouped['daily_change_value'] = daily_grouped['daily_total_value_change']
-
-            # Filter for assets with valid sync data
-            daily_active = daily_grouped[daily_grouped['daily_change_pct'].notna()].copy()
+            # Movers only change when prices/holdings do, so the aggregation is cached on a
+            # fingerprint of the columns it reads (ignore owner filter for Highlights)
+            movers_src = df[MOVERS_COLUMNS]
+            movers_key = int(pd.util.hash_pandas_object(movers_src, index=False).sum())
+            top_val, bottom_val, top_pct, bottom_pct = compute_daily_movers(movers_key, movers_src)
 
             # --- SECTION 1: By Value ---
             st.subheader("💰 Top Movers by Total Value (₹)")
             col_v1, col_v2 = st.columns(2)
 
+            # Labels/values are format strings over the movers' columns
+            mover_label = "{name} ({quantity:.0f} shares)"
+
             with col_v1:
                 st.markdown("**🚀 Top Gainers (Value)**")
-                # Sort by daily_change_value descending
-                top_val = daily_active.sort_values('daily_change_value', ascending=False).head(3)
                 if not top_val.empty:
-                    for _, row in top_val.iterrows():
-                        pct = row['daily_change_pct']
-                        val_change = row['daily_change_value']
-                        st.metric(
-                            label=f"{row['name']} ({row['quantity']:.0f} shares)", 
-                            value=f"+₹ {val_change:,.2f}", 
-                            delta=f"{pct:.2f}%",
-                            delta_color="normal"
-                        )
+                    render_metric_row(top_val, mover_label, "+₹ {daily_change_value:,.2f}", "{daily_change_pct:.2f}%")
                 else:
                     st.write("No daily data available. Hit 'Sync Live Prices'.")
 
             with col_v2:
                 st.markdown("**🔻 Top Losers (Value)**")
-                # Sort by daily_change_value ascending
-                bottom_val = daily_active.sort_values('daily_change_value', ascending=True).head(3)
                 if not bottom_val.empty:
-                    for _, row in bottom_val.iterrows():
-                         pct = row['daily_change_pct']
-                         val_change = row['daily_change_value']
-                         st.metric(
-                            label=f"{row['name']} ({row['quantity']:.0f} shares)", 
-                            value=f"₹ {val_change:,.2f}", 
-                            delta=f"{pct:.2f}%",
-                            delta_color="normal"
-                         )
+                    render_metric_row(bottom_val, mover_label, "₹ {daily_change_value:,.2f}", "{daily_change_pct:.2f}%")
                 else:
                     st.write("No daily data available.")
 
@@ -905,35 +1233,15 @@ if not df.empty:
 
             with col_p1:
                 st.markdown("**🚀 Top Gainers (%)**")
-                # Sort by daily_change_pct descending
-                top_pct = daily_active.sort_values('daily_change_pct', ascending=False).head(3)
                 if not top_pct.empty:
-                    for _, row in top_pct.iterrows():
-                        pct = row['daily_change_pct']
-                        val_change = row['daily_change_value']
-                        st.metric(
-                            label=f"{row['name']} ({row['quantity']:.0f} shares)", 
-                            value=f"{pct:.2f}%", 
-                            delta=f"₹ {val_change:+,.2f}",
-                            delta_color="normal"
-                        )
+                    render_metric_row(top_pct, mover_label, "{daily_change_pct:.2f}%", "₹ {daily_change_value:+,.2f}")
                 else:
                     st.write("No data.")
 
             with col_p2:
                 st.markdown("**🔻 Top Losers (%)**")
-                # Sort by daily_change_pct ascending
-                bottom_pct = daily_active.sort_values('daily_change_pct', ascending=True).head(3)
                 if not bottom_pct.empty:
-                    for _, row in bottom_pct.iterrows():
-                         pct = row['daily_change_pct']
-                         val_change = row['daily_change_value']
-                         st.metric(
-                            label=f"{row['name']} ({row['quantity']:.0f} shares)", 
-                            value=f"{pct:.2f}%", 
-                            delta=f"₹ {val_change:+,.2f}",
-                            delta_color="normal"
-                         )
+                    render_metric_row(bottom_pct, mover_label, "{daily_change_pct:.2f}%", "₹ {daily_change_value:+,.2f}")
                 else:
                     st.write("No data.")
 
@@ -945,47 +1253,36 @@ if not df.empty:
             # Check if we have any buy price data
             if valid_buy.any():
                 col_o1, col_o2 = st.columns(2)
+                buy_idx = valid_buy.nonzero()[0]
+                overall_df = df.iloc[buy_idx][['name', 'unit_price']].assign(overall_change_pct=overall_change_pct[buy_idx])
                 
                 with col_o1:
                     st.markdown("**🏆 Top 3 Gainers (Overall)**")
-                    top_overall = highlights_df[valid_buy].sort_values('overall_change_pct', ascending=False).head(3)
-                    for _, row in top_overall.iterrows():
-                        st.metric(label=row['name'], value=f"₹ {row['unit_price']:.2f}", delta=f"{row['overall_change_pct']:.2f}%")
+                    top_overall = overall_df.nlargest(3, 'overall_change_pct')
+                    render_metric_row(top_overall, "{name}", "₹ {unit_price:.2f}", "{overall_change_pct:.2f}%")
                 
                 with col_o2:
                     st.markdown("**📉 Top 3 Losers (Overall)**")
-                    bottom_overall = highlights_df[valid_buy].sort_values('overall_change_pct', ascending=True).head(3)
-                    for _, row in bottom_overall.iterrows():
-                        st.metric(label=row['name'], value=f"₹ {row['unit_price']:.2f}", delta=f"{row['overall_change_pct']:.2f}%")
+                    bottom_overall = overall_df.nsmallest(3, 'overall_change_pct')
+                    render_metric_row(bottom_overall, "{name}", "₹ {unit_price:.2f}", "{overall_change_pct:.2f}%")
             else:
                 st.info("ℹ️ To see Overall Gains/Losses, please enter 'Avg Buy Price' for your assets in the 'Portfolio' tab.")
         else:
              st.write("Add assets to see highlights.")
              
-    with tab2:
+    if active_tab == "Portfolio":
+        # Heavy/optional UI modules are imported where they're used (cached in sys.modules after the first time)
+        from streamlit_sortables import sort_items
         st.write("### All Assets")
         
-        # Prepare display dataframe to avoid modifying the global 'df'
-        display_df = df.copy()
+        # Totals sit above the editor (from the SQL aggregate) rather than as an extra row,
+        # so the editor gets df's own dtypes and the save path has no sentinel row to skip
+        col_total, col_diff = st.columns(2)
+        col_total.metric("💰 Total Value", f"₹ {total_net_worth:,.2f}")
+        col_diff.metric("Day Total Diff", f"₹ {total_daily_change:,.2f}")
 
-        # Add "Delete" column for explicit deletion
-        display_df.insert(0, "Delete", False)
-
-        # Append TOTAL Row for display
-        if not display_df.empty:
-            total_val = display_df['Value (INR)'].sum()
-            total_diff = display_df['daily_total_value_change'].sum()
-            
-            # Create a dictionary for the total row
-            total_row = {col: None for col in display_df.columns}
-            total_row['id'] = -1  # Dummy ID to identify and skip saving
-            total_row['name'] = "💰 TOTAL"
-            total_row['Value (INR)'] = total_val
-            total_row['daily_total_value_change'] = total_diff
-            total_row['Delete'] = False
-            
-            # Use pd.concat to append
-            display_df = pd.concat([display_df, pd.DataFrame([total_row])], ignore_index=True)
+        # Add "Delete" column for explicit deletion (assign returns a new frame, the global 'df' is untouched)
+        display_df = df.assign(Delete=False)
 
         all_cols = ['Delete', 'id', 'owner', 'dp_name', 'name', 'isin', 'ticker', 'last_updated', 'asset_type', 'quantity', 'unit_price', 'daily_price_change', 'daily_total_value_change', 'Value (INR)', 'original_currency', 'original_unit_price', 'daily_change_pct', 'avg_buy_price']
         
@@ -1035,76 +1332,87 @@ if not df.empty:
 
         if st.button("Save Changes to Database"):
             session = SessionLocal()
-            
-            # DEBUG
-            print("--- SAVE STARTED ---")
-            st.write("Processing changes...") # UI Feedback
+            try:
+                # DEBUG
+                print("--- SAVE STARTED ---")
+                st.write("Processing changes...") # UI Feedback
 
-            # 1. Handle Deletions (Explicit Checkbox)
-            rows_to_delete = edited_df[edited_df['Delete'] == True]
-            ids_to_delete = [int(i) for i in rows_to_delete['id'].unique() if i != -1]
+                # 1. Handle Deletions (Explicit Checkbox)
+                rows_to_delete = edited_df[edited_df['Delete'] == True]
+                ids_to_delete = [int(i) for i in rows_to_delete['id'].dropna().unique()]
             
-            # 2. Handle Native Deletions (Rows removed via Trash Icon)
-            # Find IDs that were in original 'display_df' but are missing from 'edited_df'
-            original_ids = set(display_df['id'].unique())
-            current_ids = set(edited_df['id'].unique())
-            missing_ids = original_ids - current_ids
+                # 2. Handle Native Deletions (Rows removed via Trash Icon)
+                # Find IDs that were in original 'display_df' but are missing from 'edited_df'
+                original_ids = set(display_df['id'].unique())
+                current_ids = set(edited_df['id'].unique())
+                missing_ids = original_ids - current_ids
             
-            # Add missing IDs to delete list (excluding the Total row if it happened to be removed)
-            for mid in missing_ids:
-                if mid != -1:
-                    ids_to_delete.append(int(mid))
-
-            # Remove duplicates
-            ids_to_delete = list(set(ids_to_delete))
-            print(f"IDs to delete: {ids_to_delete}")
+                # Add missing IDs to delete list
+                ids_to_delete.extend(int(mid) for mid in missing_ids)
+
+                # Remove duplicates
+                ids_to_delete = list(set(ids_to_delete))
+                print(f"IDs to delete: {ids_to_delete}")
             
-            if ids_to_delete:
-                try:
-                    # Fetch info for transaction cleanup
-                    to_del_info = session.query(Asset.name, Asset.owner).filter(Asset.id.in_(ids_to_delete)).all()
-
-                    # Perform deletion
-                    del_count = session.query(Asset).filter(Asset.id.in_(ids_to_delete)).delete(synchronize_session=False)
-                    print(f"Deleted from DB: {del_count}")
-
-                    # Delete Transactions
-                    for name, owner_name in to_del_info:
-                        session.query(InvestmentTransaction).filter(
-                            InvestmentTransaction.asset_name == name, 
-                            InvestmentTransaction.owner == owner_name
-                        ).delete(synchronize_session=False)
+                if ids_to_delete:
+                    try:
+                        # Fetch info for transaction cleanup
+                        to_del_info = session.query(Asset.name, Asset.owner).filter(Asset.id.in_(ids_to_delete)).all()
+
+                        # Perform deletion
+                        del_count = session.query(Asset).filter(Asset.id.in_(ids_to_delete)).delete(synchronize_session=False)
+                        print(f"Deleted from DB: {del_count}")
+
+                        # Delete Transactions (one statement for all deleted (name, owner) pairs)
+                        if to_del_info:
+                            session.query(InvestmentTransaction).filter(
+                                sqlalchemy.tuple_(InvestmentTransaction.asset_name, InvestmentTransaction.owner).in_(
+                                    [tuple(pair) for pair in to_del_info]
+                                )
+                            ).delete(synchronize_session=False)
                         
-                    st.toast(f"Deleted {del_count} assets and associated transactions.", icon="🗑️")
-                    st.success(f"Deleted {del_count} assets.")
-                except Exception as e:
-                    session.rollback()
-                    print(f"ERROR deleting: {e}")
-                    st.error(f"Error deleting: {e}")
+                        st.toast(f"Deleted {del_count} assets and associated transactions.", icon="🗑️")
+                        st.success(f"Deleted {del_count} assets.")
+                    except Exception as e:
+                        session.rollback()
+                        print(f"ERROR deleting: {e}")
+                        st.error(f"Error deleting: {e}")
             
-            # 3. Handle Updates
-            # Filter out deleted rows and total row
-            # If using native delete, 'rows_to_update' naturally excludes them.
-            rows_to_update = edited_df[(edited_df['Delete'] == False) & (edited_df['id'] != -1)]
+                # 3. Handle Updates
+                # Filter out deleted rows
+                # If using native delete, 'rows_to_update' naturally excludes them.
+                rows_to_update = edited_df[edited_df['Delete'] == False]
             
-            for index, row in rows_to_update.iterrows():
-                if pd.isna(row['id']): continue
-                
-                asset = session.query(Asset).filter(Asset.id == row['id']).first()
-                if asset:
-                    if 'ticker' in row: asset.ticker = row['ticker']
-                    if 'quantity' in row: asset.quantity = row['quantity']
-                    if 'unit_price' in row: asset.unit_price = row['unit_price']
-                    if 'avg_buy_price' in row: asset.avg_buy_price = row['avg_buy_price']
+                # One executemany UPDATE for the editable columns, limited to rows the user actually changed
+                edit_cols = [c for c in ('ticker', 'quantity', 'unit_price', 'avg_buy_price') if c in rows_to_update.columns]
+                rows_to_update = rows_to_update.dropna(subset=['id'])
+                updates = []
+                if edit_cols and not rows_to_update.empty:
+                    new = rows_to_update.set_index('id')[edit_cols]
+                    orig = display_df.set_index('id')[edit_cols].reindex(new.index)
+                    # NaN == NaN counts as unchanged
+                    unchanged = (new == orig) | (new.isna() & orig.isna())
+                    changed = new[~unchanged.all(axis=1)].reset_index().astype(object)
+                    updates = changed.where(changed.notna(), None).to_dict('records')
+                    for row in updates:
+                        row['id'] = int(row['id'])
+                print(f"Rows changed: {len(updates)}")
             
-            session.commit()
-            session.close()
-            st.cache_data.clear()
-            st.success("Changes Saved!")
-            time.sleep(1) # Give user time to see success message
-            st.rerun()
+                if not updates and not ids_to_delete:
+                    st.info("No changes to save.")
+                else:
+                    if updates:
+                        session.bulk_update_mappings(Asset, updates)
+                    session.commit()
+                    st.cache_data.clear()
+                    st.success("Changes Saved!")
+                    time.sleep(1) # Give user time to see success message
+                    st.rerun()
+            finally:
+                session.close()
 
-    with tab3:
+    if active_tab == "Analysis":
+        import plotly.express as px
         st.header("Detailed Portfolio Analysis")
         
         # --- Top Level Filters ---
@@ -1118,7 +1426,8 @@ if not df.empty:
             
         # Apply Filters
         if not df.empty:
-            filtered_df = df[df['owner'].isin(sel_owners) & df['asset_type'].isin(sel_types)].copy()
+            # Boolean indexing already returns a new frame; no extra .copy() needed
+            filtered_df = df[df['owner'].isin(sel_owners) & df['asset_type'].isin(sel_types)]
         else:
             filtered_df = pd.DataFrame()
         
@@ -1126,17 +1435,19 @@ if not df.empty:
             st.info("No data available for the selected filters.")
         else:
             # --- KPI Row ---
-            total_inr = filtered_df['Value (INR)'].sum()
+            # With nothing filtered out this is the rerun's SQL total; only subsets are re-summed
+            total_inr = total_net_worth if len(filtered_df) == len(df) else filtered_df['Value (INR)'].sum()
             
             # GBP specific calculations
             # Ensure we handle NaN in original_currency/price safely
-            gbp_mask = filtered_df['original_currency'] == 'GBP'
-            gbp_assets = filtered_df[gbp_mask]
+            # Mask once, then reduce raw arrays; nansum treats a missing original price as 0
+            gbp_mask = (filtered_df['original_currency'] == 'GBP').to_numpy()
             
             # Calculate Total GBP (sum of qty * original_price)
-            # Fillna(0) just in case, though logically shouldn't be needed if mask is correct
-            total_gbp = (gbp_assets['quantity'] * gbp_assets['original_unit_price'].fillna(0)).sum()
-            total_gbp_inr_equiv = gbp_assets['Value (INR)'].sum()
+            gbp_qty = filtered_df['quantity'].to_numpy(dtype=np.float64)[gbp_mask]
+            gbp_price = filtered_df['original_unit_price'].to_numpy(dtype=np.float64)[gbp_mask]
+            total_gbp = np.nansum(gbp_qty * gbp_price)
+            total_gbp_inr_equiv = np.nansum(filtered_df['Value (INR)'].to_numpy(dtype=np.float64)[gbp_mask])
             
             kpi1, kpi2, kpi3 = st.columns(3)
             kpi1.metric("Total Filtered Value (INR)", f"₹ {total_inr:,.0f}")
@@ -1149,15 +1460,14 @@ if not df.empty:
             view_mode = st.radio("Group Data By:", ["Asset Class", "DP / AMC", "Individual Assets", "Currency"], horizontal=True)
             
             if view_mode == "Asset Class":
-                grouped = filtered_df.groupby("asset_type")['Value (INR)'].sum().reset_index()
+                grouped = filtered_df.groupby("asset_type", observed=True)['Value (INR)'].sum().reset_index()
                 fig = px.pie(grouped, values='Value (INR)', names='asset_type', title='Allocation by Asset Class', hole=0.4)
                 st.plotly_chart(fig, use_container_width=True)
                 
             elif view_mode == "DP / AMC":
-                # Handle None/NaN DP names
-                filtered_df['dp_name_display'] = filtered_df['dp_name'].fillna('Unknown')
-                grouped = filtered_df.groupby("dp_name_display")['Value (INR)'].sum().reset_index().sort_values('Value (INR)', ascending=False)
-                fig = px.bar(grouped, x='dp_name_display', y='Value (INR)', color='dp_name_display', title='Value by DP / AMC', labels={'dp_name_display': 'DP / AMC'})
+                # Missing DP names are already 'Unknown' from get_assets_df
+                grouped = filtered_df.groupby("dp_name", observed=True)['Value (INR)'].sum().reset_index().sort_values('Value (INR)', ascending=False)
+                fig = px.bar(grouped, x='dp_name', y='Value (INR)', color='dp_name', title='Value by DP / AMC', labels={'dp_name': 'DP / AMC'})
                 st.plotly_chart(fig, use_container_width=True)
                 
             elif view_mode == "Individual Assets":
@@ -1167,26 +1477,19 @@ if not df.empty:
                 st.plotly_chart(fig, use_container_width=True)
 
             elif view_mode == "Currency":
-                 filtered_df['display_currency'] = filtered_df['original_currency'].fillna('INR')
-                 grouped = filtered_df.groupby("display_currency")['Value (INR)'].sum().reset_index()
-                 fig = px.pie(grouped, values='Value (INR)', names='display_currency', title='Exposure by Currency (converted to INR)', hole=0.4)
+                 grouped = filtered_df.groupby("original_currency", observed=True)['Value (INR)'].sum().reset_index()
+                 fig = px.pie(grouped, values='Value (INR)', names='original_currency', title='Exposure by Currency (converted to INR)', hole=0.4)
                  st.plotly_chart(fig, use_container_width=True)
 
             st.markdown("### 🌳 Portfolio Map")
-            # Fill NaNs for treemap path to avoid errors
-            filtered_df['dp_name'] = filtered_df['dp_name'].fillna('Unknown')
-            filtered_df['asset_type'] = filtered_df['asset_type'].fillna('Other')
-            
-            fig_tree = px.treemap(
-                filtered_df, 
-                path=[px.Constant("Total Portfolio"), 'owner', 'asset_type', 'dp_name', 'name'], 
-                values='Value (INR)',
-                color='asset_type',
-                title='Hierarchical Portfolio View'
-            )
-            st.plotly_chart(fig_tree, use_container_width=True)
+            # dp_name/asset_type NaNs are filled in get_assets_df, so the treemap path is always complete.
+            # Roll up to one row per leaf here so the browser gets O(leaves) data, not every asset row.
+            tree_df = filtered_df.groupby(TREEMAP_PATH, observed=True, as_index=False)['Value (INR)'].sum()
+            tree_key = int(pd.util.hash_pandas_object(tree_df, index=False).sum())
+            st.plotly_chart(build_treemap_figure(tree_key, tree_df), use_container_width=True)
              
-    with tab4:
+    if active_tab == "Growth Graph":
+        import plotly.express as px
         st.header("Portfolio Growth & Trends")
         history_df = get_history_df()
         
@@ -1198,52 +1501,39 @@ if not df.empty:
             # Use GLOBAL total_net_worth for the most up-to-date 'current' value
             current_val = total_net_worth
             
+            # One fused pass over contiguous arrays (Numba when available) instead of masked .loc gathers
+            monthly_market_change, total_growth_market, n_30d, n_buy = get_growth_kernel()(
+                np.ascontiguousarray(df['unit_price'].to_numpy(dtype=np.float64)),
+                np.ascontiguousarray(df['quantity'].to_numpy(dtype=np.float64)),
+                np.ascontiguousarray(df['price_30d'].to_numpy(dtype=np.float64)),
+                np.ascontiguousarray(df['avg_buy_price'].to_numpy(dtype=np.float64)),
+            )
+
             # 1. Daily Change (Based on Live Data, consistent with Portfolio Tab)
-            if 'daily_total_value_change' in df.columns:
-                daily_change = df['daily_total_value_change'].sum()
-                
-                # Calculate previous day's theoretical close to get %
-                prev_day_close = current_val - daily_change
-                if prev_day_close != 0:
-                    daily_pct = (daily_change / prev_day_close) * 100
-                else:
-                    daily_pct = 0.0
-            else:
-                daily_change = 0.0
-                daily_pct = 0.0
+            daily_change = total_daily_change
+            # Calculate previous day's theoretical close to get %
+            prev_day_close = current_val - daily_change
+            daily_pct = (daily_change / prev_day_close) * 100 if prev_day_close != 0 else 0.0
             
             # 2. Monthly Change (Market Value Change over 30d)
             # This uses 'price_30d' column populated by background_updater
-            monthly_market_change = 0.0
+            # Sum of (Current Price - Price 30 Days Ago) * Qty, only where price_30d is available
             month_pct = 0.0
-            
-            if 'price_30d' in df.columns:
-                # Calculate only for assets where price_30d is available
-                valid_30d = df['price_30d'].notna() & (df['price_30d'] > 0)
-                if valid_30d.any():
-                    # Sum of (Current Price - Price 30 Days Ago) * Qty
-                    monthly_market_change = ((df.loc[valid_30d, 'unit_price'] - df.loc[valid_30d, 'price_30d']) * df.loc[valid_30d, 'quantity']).sum()
-                    
-                    # Base value 30 days ago for % calc
-                    # Theoretical Base = Current Value - Gain
-                    base_val_month = current_val - monthly_market_change
-                    if base_val_month != 0:
-                        month_pct = (monthly_market_change / base_val_month) * 100
+            if n_30d:
+                # Base value 30 days ago for % calc
+                # Theoretical Base = Current Value - Gain
+                base_val_month = current_val - monthly_market_change
+                if base_val_month != 0:
+                    month_pct = (monthly_market_change / base_val_month) * 100
             
             # 3. Total Growth (Since Buy - Market P&L)
             # Calculate sum of (Current - AvgBuy) * Qty
-            total_growth_market = 0.0
             total_pct = 0.0
-            
-            if 'avg_buy_price' in df.columns:
-                valid_buy = df['avg_buy_price'].notna() & (df['avg_buy_price'] > 0)
-                if valid_buy.any():
-                    total_growth_market = ((df.loc[valid_buy, 'unit_price'] - df.loc[valid_buy, 'avg_buy_price']) * df.loc[valid_buy, 'quantity']).sum()
-                    
-                    # Base Cost = Current Value - Total Profit
-                    cost_basis = current_val - total_growth_market
-                    if cost_basis != 0:
-                        total_pct = (total_growth_market / cost_basis) * 100
+            if n_buy:
+                # Base Cost = Current Value - Total Profit
+                cost_basis = current_val - total_growth_market
+                if cost_basis != 0:
+                    total_pct = (total_growth_market / cost_basis) * 100
             
             # --- Display Metrics ---
             m1, m2, m3, m4 = st.columns(4)
@@ -1273,11 +1563,16 @@ if not df.empty:
                     trans_df = trans_df[trans_df['owner'] == selected_inv_owner]
 
                 if not trans_df.empty:
-                    trans_df['date'] = pd.to_datetime(trans_df['date'])
-                    trans_df['Month'] = trans_df['date'].dt.strftime('%Y-%m')
-                    
+                    # The loader already parses dates; only re-parse if that ever changes
+                    if not pd.api.types.is_datetime64_any_dtype(trans_df['date']):
+                        trans_df['date'] = pd.to_datetime(trans_df['date'], errors='coerce')
+                    # Month as a vectorised period; only the distinct months are formatted to 'YYYY-MM'
+                    # (sorted, so the categorical groupby below comes out in calendar order)
+                    month_codes, months = pd.factorize(trans_df['date'].dt.to_period('M'), sort=True)
+                    trans_df['Month'] = pd.Categorical.from_codes(month_codes, months.strftime('%Y-%m'))
+
                     # Monthly Aggregation
-                    monthly_inv = trans_df[trans_df['transaction_type'] == 'BUY'].groupby('Month')['total_amount'].sum().reset_index()
+                    monthly_inv = trans_df[trans_df['transaction_type'] == 'BUY'].groupby('Month', observed=True)['total_amount'].sum().reset_index()
                     
                     fig_inv = px.bar(monthly_inv, x='Month', y='total_amount', title=f'Monthly Investment Amount ({selected_inv_owner})', text_auto='.2s')
                     fig_inv.update_traces(marker_color='#FF5733')
@@ -1293,260 +1588,265 @@ if not df.empty:
         else:
             st.info("Growth history will be built as you visit the app over time.")
             
-    with tab5:
+    if active_tab == "Settings":
         st.header("⚙️ Settings")
         st.subheader("Email Report Configuration")
         
+        # One session for the whole tab; closed even if a handler raises or reruns the script
         session = SessionLocal()
-        settings = session.query(AppSettings).filter(AppSettings.id == 1).first()
+        try:
+            settings = session.get(AppSettings, 1) # PK lookup via the identity map
         
-        with st.form("email_settings_form"):
-            smtp_server = st.text_input("SMTP Server", value=settings.smtp_server or "smtp.gmail.com")
-            smtp_port = st.number_input("SMTP Port", value=settings.smtp_port or 587)
-            sender_email = st.text_input("Sender Email", value=settings.sender_email or "")
-            sender_password = st.text_input("Sender Password (App Password)", value=settings.sender_password or "", type="password")
-            receiver_email = st.text_input("Receiver Email", value=settings.receiver_email or "")
+            with st.form("email_settings_form"):
+                smtp_server = st.text_input("SMTP Server", value=settings.smtp_server or "smtp.gmail.com")
+                smtp_port = st.number_input("SMTP Port", value=settings.smtp_port or 587)
+                sender_email = st.text_input("Sender Email", value=settings.sender_email or "")
+                sender_password = st.text_input("Sender Password (App Password)", value=settings.sender_password or "", type="password")
+                receiver_email = st.text_input("Receiver Email", value=settings.receiver_email or "")
             
-            if st.form_submit_button("Save Settings"):
-                settings.smtp_server = smtp_server
-                settings.smtp_port = int(smtp_port)
-                settings.sender_email = sender_email
-                settings.sender_password = sender_password
-                settings.receiver_email = receiver_email
-                session.commit()
-                st.success("Settings saved successfully!")
+                if st.form_submit_button("Save Settings"):
+                    settings.smtp_server = smtp_server
+                    settings.smtp_port = int(smtp_port)
+                    settings.sender_email = sender_email
+                    settings.sender_password = sender_password
+                    settings.receiver_email = receiver_email
+                    session.commit()
+                    st.success("Settings saved successfully!")
                 
-        st.divider()
-        st.subheader("Gotify Notification Configuration")
+            st.divider()
+            st.subheader("Gotify Notification Configuration")
         
-        with st.form("gotify_settings_form"):
-            gotify_enabled = st.checkbox("Enable Gotify Notifications", value=settings.gotify_enabled if settings.gotify_enabled is not None else False)
-            gotify_url = st.text_input("Gotify Server URL", value=settings.gotify_url or "https://your-gotify-instance.com", help="Base URL of your Gotify server, e.g., https://push.example.com")
-            gotify_token = st.text_input("Gotify App Token", value=settings.gotify_token or "", type="password")
+            with st.form("gotify_settings_form"):
+                gotify_enabled = st.checkbox("Enable Gotify Notifications", value=settings.gotify_enabled if settings.gotify_enabled is not None else False)
+                gotify_url = st.text_input("Gotify Server URL", value=settings.gotify_url or "https://your-gotify-instance.com", help="Base URL of your Gotify server, e.g., https://push.example.com")
+                gotify_token = st.text_input("Gotify App Token", value=settings.gotify_token or "", type="password")
             
-            if st.form_submit_button("Save Gotify Settings"):
-                settings.gotify_enabled = gotify_enabled
-                settings.gotify_url = gotify_url.rstrip('/') # Remove trailing slash if present
-                settings.gotify_token = gotify_token
-                session.commit()
-                st.success("Gotify settings saved!")
-
-        if st.button("🔔 Send Test Notification"):
-            if not settings.gotify_url or not settings.gotify_token:
-                st.error("Please configure and save Gotify URL and Token first.")
-            else:
-                try:
-                    full_url = f"{settings.gotify_url}/message?token={settings.gotify_token}"
-                    payload = {
-                        "title": "FinanceApp Test",
-                        "message": "This is a test notification from your Finance App.",
-                        "priority": 5
-                    }
-                    resp = requests.post(full_url, json=payload, timeout=5)
-                    if resp.status_code == 200:
-                        st.success("Notification sent successfully!")
-                    else:
-                        st.error(f"Failed to send: {resp.status_code} - {resp.text}")
-                except Exception as e:
-                    st.error(f"Error sending notification: {e}")
+                if st.form_submit_button("Save Gotify Settings"):
+                    settings.gotify_enabled = gotify_enabled
+                    settings.gotify_url = gotify_url.rstrip('/') # Remove trailing slash if present
+                    settings.gotify_token = gotify_token
+                    session.commit()
+                    st.success("Gotify settings saved!")
+
+            if st.button("🔔 Send Test Notification"):
+                if not settings.gotify_url or not settings.gotify_token:
+                    st.error("Please configure and save Gotify URL and Token first.")
+                else:
+                    try:
+                        full_url = f"{settings.gotify_url}/message?token={settings.gotify_token}"
+                        payload = {
+                            "title": "FinanceApp Test",
+                            "message": "This is a test notification from your Finance App.",
+                            "priority": 5
+                        }
+                        resp = requests.post(full_url, json=payload, timeout=5)
+                        if resp.status_code == 200:
+                            st.success("Notification sent successfully!")
+                        else:
+                            st.error(f"Failed to send: {resp.status_code} - {resp.text}")
+                    except Exception as e:
+                        st.error(f"Error sending notification: {e}")
 
-        st.divider()
-        st.subheader("Daily Report Schedule")
+            st.divider()
+            st.subheader("Daily Report Schedule")
         
-        with st.form("scheduler_settings_form"):
-            c_sch1, c_sch2 = st.columns(2)
-            with c_sch1:
-                report_enabled = st.checkbox("Enable Daily Email Report", value=settings.report_enabled if settings.report_enabled is not None else False)
-            with c_sch2:
-                # Use text input for time (HH:MM) simplicity, or time_input
-                # We need to parse string to time object for time_input if it exists
-                default_time = datetime.time(18, 0)
-                if settings.report_time:
-                    try:
-                        h, m = map(int, settings.report_time.split(':'))
-                        default_time = datetime.time(h, m)
-                    except:
-                        pass
+            with st.form("scheduler_settings_form"):
+                c_sch1, c_sch2 = st.columns(2)
+                with c_sch1:
+                    report_enabled = st.checkbox("Enable Daily Email Report", value=settings.report_enabled if settings.report_enabled is not None else False)
+                with c_sch2:
+                    # Use text input for time (HH:MM) simplicity, or time_input
+                    # We need to parse string to time object for time_input if it exists
+                    default_time = datetime.time(18, 0)
+                    if settings.report_time:
+                        try:
+                            h, m = map(int, settings.report_time.split(':'))
+                            default_time = datetime.time(h, m)
+                        except ValueError:
+                            pass
                 
-                report_time_obj = st.time_input("Run Report At (Server Time)", value=default_time)
+                    report_time_obj = st.time_input("Run Report At (Server Time)", value=default_time)
             
-            if st.form_submit_button("Update Schedule"):
-                settings.report_enabled = report_enabled
-                settings.report_time = report_time_obj.strftime("%H:%M")
-                session.commit()
-                st.success(f"Schedule updated! Report will run at {settings.report_time} daily.")
-
-        st.divider()
-        st.subheader("Test Configuration")
-        if st.button("📧 Send Test Email Now"):
-            # Trigger the daily email report script via subprocess to test
-            try:
-                # Run the script using the current python executable
-                result = subprocess.run(
-                    [sys.executable, "daily_email_report.py"], 
-                    capture_output=True, 
-                    text=True, 
-                    cwd=os.getcwd()
-                )
-                if result.returncode == 0:
+                if st.form_submit_button("Update Schedule"):
+                    settings.report_enabled = report_enabled
+                    settings.report_time = report_time_obj.strftime("%H:%M")
+                    session.commit()
+                    st.success(f"Schedule updated! Report will run at {settings.report_time} daily.")
+
+            st.divider()
+            st.subheader("Test Configuration")
+            # The report runs on a worker thread so the page stays responsive; its result is shown on a later rerun
+            email_job = st.session_state.get('test_email_job')
+            if st.button("📧 Send Test Email Now", disabled=bool(email_job and email_job['status'] == 'running')):
+                email_job = {'status': 'running', 'message': ''}
+                st.session_state.test_email_job = email_job
+                threading.Thread(target=run_test_email, args=(email_job,), daemon=True).start()
+            if email_job:
+                if email_job['status'] == 'running':
+                    st.info("Sending test report in the background... interact with the page to refresh the status.")
+                elif email_job['status'] == 'done':
                     st.success("Test email command executed! Check the logs/output.")
-                    st.text(result.stdout)
+                    st.text(email_job['message'])
                 else:
                     st.error("Error executing script.")
-                    st.text(result.stderr)
-            except Exception as e:
-                st.error(f"Failed to run test: {e}")
+                    st.text(email_job['message'])
         
-        st.divider()
-        st.subheader("AI Configuration")
-        with st.form("ai_settings_form"):
-            api_key_val = st.text_input("Groq API Key", value=settings.groq_api_key or "", type="password", help="Get free key from https://console.groq.com/keys")
+            st.divider()
+            st.subheader("AI Configuration")
+            with st.form("ai_settings_form"):
+                api_key_val = st.text_input("Groq API Key", value=settings.groq_api_key or "", type="password", help="Get free key from https://console.groq.com/keys")
             
-            # Get available columns from the main dataframe if available
-            avail_cols = list(df.columns) if 'df' in locals() and not df.empty else ["name", "ticker", "quantity", "unit_price", "Value (INR)", "daily_change_pct"]
+                # Get available columns from the main dataframe if available
+                avail_cols = list(df.columns) if 'df' in locals() and not df.empty else DEFAULT_AI_CONTEXT_COLUMNS.split(",")
             
-            # Load saved columns
-            current_saved = settings.ai_context_columns.split(",") if settings.ai_context_columns else ["name", "ticker", "quantity", "unit_price", "Value (INR)", "daily_change_pct"]
-            # Filter to ensure they exist in current df
-            default_sel = [c for c in current_saved if c in avail_cols]
+                # Load saved columns
+                current_saved = (settings.ai_context_columns or DEFAULT_AI_CONTEXT_COLUMNS).split(",")
+                # Filter to ensure they exist in current df
+                default_sel = [c for c in current_saved if c in avail_cols]
             
-            context_cols = st.multiselect(
-                "Select Data Columns for AI Context", 
-                options=avail_cols, 
-                default=default_sel,
-                help="Sending fewer columns reduces token usage and helps avoid rate limits."
-            )
+                context_cols = st.multiselect(
+                    "Select Data Columns for AI Context", 
+                    options=avail_cols, 
+                    default=default_sel,
+                    help="Sending fewer columns reduces token usage and helps avoid rate limits."
+                )
             
-            if st.form_submit_button("Save AI Settings"):
-                settings.groq_api_key = api_key_val
-                settings.ai_context_columns = ",".join(context_cols)
-                session.commit()
-                st.session_state.groq_api_key = api_key_val
-                st.success("AI Settings Saved!")
-                
-        st.divider()
-        st.subheader("🛠️ Data Tools")
-        if st.button("🔄 Reset Growth History Baseline", help="Deletes all historical tracking data and sets 'yesterday' as the new starting point based on current prices."):
-            try:
-                session = SessionLocal()
-                # 1. Calculate Baseline
-                # We need live total and live daily change
-                current_total = df['Value (INR)'].sum()
-                current_daily_diff = df['daily_total_value_change'].sum()
-                baseline_val = current_total - current_daily_diff
+                if st.form_submit_button("Save AI Settings"):
+                    settings.groq_api_key = api_key_val
+                    settings.ai_context_columns = ",".join(context_cols)
+                    session.commit()
+                    st.session_state.groq_api_key = api_key_val
+                    st.session_state.ai_context_columns = settings.ai_context_columns
+                    st.success("AI Settings Saved!")
                 
-                # 2. Clear History
-                session.query(PortfolioHistory).delete()
+            st.divider()
+            st.subheader("🛠️ Data Tools")
+            if st.button("🔄 Reset Growth History Baseline", help="Deletes all historical tracking data and sets 'yesterday' as the new starting point based on current prices."):
+                try:
+                    # Reuses the tab's session: the pool has a single connection
+                    # 1. Calculate Baseline
+                    # We need live total and live daily change
+                    baseline_val = total_net_worth - total_daily_change
                 
-                # 3. Insert Yesterday's Baseline
-                yesterday = datetime.date.today() - datetime.timedelta(days=1)
-                session.add(PortfolioHistory(date=yesterday, total_value=baseline_val))
+                    # 2. Clear History
+                    session.query(PortfolioHistory).delete()
                 
-                # 4. Insert Today's Actual
-                today = datetime.date.today()
-                session.add(PortfolioHistory(date=today, total_value=current_total))
+                    # 3. Insert Yesterday's Baseline and Today's Actual as one executemany INSERT,
+                    # committed together with the delete
+                    today = datetime.date.today()
+                    yesterday = today - datetime.timedelta(days=1)
+                    session.execute(sqlalchemy.insert(PortfolioHistory), [
+                        {"date": yesterday, "total_value": baseline_val},
+                        {"date": today, "total_value": total_net_worth},
+                    ])
                 
-                session.commit()
-                session.close()
-                st.success("Growth history reset! Your baseline now starts from yesterday's closing prices.")
-                time.sleep(1)
-                st.rerun()
-                if result.returncode == 0:
-                    st.success("Test email command executed! Check the logs/output.")
-                    st.text(result.stdout)
-                else:
-                    st.error("Error executing script.")
-                    st.text(result.stderr)
-            except Exception as e:
-                st.error(f"Error executing script: {e}")
+                    session.commit()
+                    session.close()
+                    # get_history_df is cached between writes
+                    st.cache_data.clear()
+                    st.success("Growth history reset! Your baseline now starts from yesterday's closing prices.")
+                    time.sleep(1)
+                    st.rerun()
+                    if result.returncode == 0:
+                        st.success("Test email command executed! Check the logs/output.")
+                        st.text(result.stdout)
+                    else:
+                        st.error("Error executing script.")
+                        st.text(result.stderr)
+                except Exception as e:
+                    st.error(f"Error executing script: {e}")
 
-        st.divider()
-        st.subheader("Data Cleanup")
-        with st.expander("Danger Zone"):
-            st.warning("These actions are destructive. Please be careful.")
+            st.divider()
+            st.subheader("Data Cleanup")
+            with st.expander("Danger Zone"):
+                st.warning("These actions are destructive. Please be careful.")
             
-            clean_owner = st.selectbox("Select Owner to Clean History", ["Select...", "Vivek", "Wife", "Father", "Mother"])
-            if clean_owner != "Select...":
-                if st.button(f"🗑️ Clear Transaction History for {clean_owner}"):
-                    # Backup before destructive action
-                    bkp = backup_database()
-                    if bkp:
-                        st.info(f"Backup created: {bkp}")
+                clean_owner = st.selectbox("Select Owner to Clean History", ["Select...", "Vivek", "Wife", "Father", "Mother"])
+                if clean_owner != "Select...":
+                    if st.button(f"🗑️ Clear Transaction History for {clean_owner}"):
+                        # Backup before destructive action
+                        bkp = backup_database()
+                        if bkp:
+                            st.info(f"Backup created: {bkp}")
                     
-                    # Clear investment_transactions for this owner
-                    try:
-                        del_count = session.query(InvestmentTransaction).filter(InvestmentTransaction.owner == clean_owner).delete()
-                        session.commit()
-                        st.success(f"Deleted {del_count} transaction records for {clean_owner}.")
-                        st.cache_data.clear()
-                    except Exception as e:
-                        st.error(f"Error cleaning history: {e}")
-
-                st.markdown("---")
-                if st.button(f"🧨 Delete ENTIRE Portfolio & History for {clean_owner}", type="primary", help="Deletes ALL assets and transactions. Cannot be undone without restoring backup."):
-                    # Backup before destructive action
-                    bkp = backup_database()
-                    if bkp:
-                        st.info(f"Backup created: {bkp}")
+                        # Clear investment_transactions for this owner (one Core DELETE, no ORM sync)
+                        try:
+                            del_count = session.execute(
+                                sqlalchemy.delete(InvestmentTransaction).where(InvestmentTransaction.owner == clean_owner)
+                            ).rowcount
+                            session.commit()
+                            st.success(f"Deleted {del_count} transaction records for {clean_owner}.")
+                            st.cache_data.clear()
+                        except Exception as e:
+                            session.rollback()
+                            st.error(f"Error cleaning history: {e}")
+
+                    st.markdown("---")
+                    if st.button(f"🧨 Delete ENTIRE Portfolio & History for {clean_owner}", type="primary", help="Deletes ALL assets and transactions. Cannot be undone without restoring backup."):
+                        # Backup before destructive action
+                        bkp = backup_database()
+                        if bkp:
+                            st.info(f"Backup created: {bkp}")
                     
-                    try:
-                        # Delete Assets
-                        asset_count = session.query(Asset).filter(Asset.owner == clean_owner).delete()
-                        # Delete Transactions
-                        trans_count = session.query(InvestmentTransaction).filter(InvestmentTransaction.owner == clean_owner).delete()
+                        try:
+                            # Both DELETEs commit together (one fsync), or neither does: a failure
+                            # rolls back so assets are never removed with their transactions left behind
+                            # Delete Assets
+                            asset_count = session.execute(sqlalchemy.delete(Asset).where(Asset.owner == clean_owner)).rowcount
+                            # Delete Transactions
+                            trans_count = session.execute(
+                                sqlalchemy.delete(InvestmentTransaction).where(InvestmentTransaction.owner == clean_owner)
+                            ).rowcount
                         
-                        session.commit()
-                        st.success(f"Full Reset Complete: Deleted {asset_count} assets and {trans_count} transaction records for {clean_owner}.")
-                        st.cache_data.clear()
-                        time.sleep(1)
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Error resetting portfolio: {e}")
+                            session.commit()
+                            st.success(f"Full Reset Complete: Deleted {asset_count} assets and {trans_count} transaction records for {clean_owner}.")
+                            st.cache_data.clear()
+                            session.close()
+                            time.sleep(1)
+                            st.rerun()
+                        except Exception as e:
+                            session.rollback()
+                            st.error(f"Error resetting portfolio: {e}")
             
-            st.divider()
-            st.subheader("Database Restore")
+                st.divider()
+                st.subheader("Database Restore")
             
-            # Determine DB Directory and Filename
-            db_dir = os.path.dirname(DB_FILE)
-            db_filename = os.path.basename(DB_FILE)
+                # Determine DB Directory and Filename
+                db_dir = os.path.dirname(DB_FILE)
+                db_filename = os.path.basename(DB_FILE)
             
-            # List available backups in the DB directory
-            try:
-                # Filter for files that start with the DB filename (e.g. finance.db.2023...)
-                backups = [f for f in os.listdir(db_dir) if f.startswith(f"{db_filename}.") and f.endswith('.bak')]
-                backups.sort(reverse=True) # Newest first
-            except Exception as e:
-                st.error(f"Error reading backup directory: {e}")
-                backups = []
+                # List available backups in the DB directory
+                try:
+                    backups = list_backups(db_dir, db_filename)
+                except Exception as e:
+                    st.error(f"Error reading backup directory: {e}")
+                    backups = []
             
-            if backups:
-                selected_backup = st.selectbox("Select Backup to Restore", ["Select..."] + backups)
-                if selected_backup != "Select...":
-                    if st.button(f"⚠️ Restore {selected_backup}"):
-                        try:
-                            # 1. Backup current state just in case
-                            pre_restore_bkp = backup_database()
-                            st.info(f"Safety backup created: {pre_restore_bkp}")
-                            
-                            # 2. Perform Restore
-                            src = os.path.join(db_dir, selected_backup)
-                            # Close session before overwriting DB file
-                            session.close()
+                if backups:
+                    selected_backup = st.selectbox("Select Backup to Restore", ["Select..."] + backups)
+                    if selected_backup != "Select...":
+                        if st.button(f"⚠️ Restore {selected_backup}"):
+                            try:
+                                # 1. Backup current state just in case
+                                pre_restore_bkp = backup_database()
+                                st.info(f"Safety backup created: {pre_restore_bkp}")
                             
-                            # Give a small delay to ensure file handles are released if possible
-                            time.sleep(1)
-                            
-                            shutil.copy2(src, DB_FILE)
-                            st.success(f"Database restored from {selected_backup} successfully!")
-                            st.warning("Please refresh the page to reload the data.")
-                        except Exception as e:
-                            st.error(f"Error restoring database: {e}")
-            else:
-                st.info("No backups found.")
-        
-        session.close()
+                                # 2. Perform Restore
+                                src = os.path.join(db_dir, selected_backup)
+                                # Release the tab's connection so the backup can take its write lock
+                                session.close()
+                                copy_sqlite_database(src, DB_FILE)
+                                st.cache_data.clear()
+                                st.success(f"Database restored from {selected_backup} successfully!")
+                                st.warning("Please refresh the page to reload the data.")
+                            except Exception as e:
+                                st.error(f"Error restoring database: {e}")
+                else:
+                    st.info("No backups found.")
+        finally:
+            session.close()
 
-    with tab6:
+    if active_tab == "AI Insights":
         st.header("🤖 AI Financial Assistant (Powered by Groq)")
         st.info("Ask questions about your portfolio and get insights using Llama 3 on Groq.")
 
@@ -1554,7 +1854,7 @@ if not df.empty:
         
         if api_key:
             try:
-                client = Groq(api_key=api_key)
+                client = get_groq_client(api_key)
                 
                 # Chat Interface
                 if "messages" not in st.session_state:
@@ -1572,24 +1872,13 @@ if not df.empty:
 
                     # Prepare Context
                     try:
-                        # Create a context-rich dataframe with ALL fields
-                        context_df = df.copy()
-                        
-                        # Optimization: Round floats to 2 decimal places to save tokens
-                        for col in context_df.select_dtypes(include=['float', 'float64']).columns:
-                            context_df[col] = context_df[col].round(2)
-                        
-                        # HARD LIMIT: Sort by Value and take top 50 to prevent Token Limit Exceeded
-                        if 'Value (INR)' in context_df.columns:
-                            context_df = context_df.sort_values('Value (INR)', ascending=False).head(50)
-                        else:
-                            context_df = context_df.head(50)
-
-                        # Calculate total value (might not be in context_df anymore)
-                        total_val = df['Value (INR)'].sum() if 'Value (INR)' in df.columns else 0
-                        
-                        # Convert to CSV string
-                        csv_data = context_df.to_csv(index=False)
+                        # Only the columns chosen in Settings go to the model (fewer tokens);
+                        # rebuilt only when that data changes, not on every question
+                        ctx_df = df[ai_context_columns(df)]
+                        ctx_key = (tuple(ctx_df.columns), int(pd.util.hash_pandas_object(ctx_df, index=False).sum()))
+                        csv_data = build_ai_context(ctx_key, ctx_df)
+                        # The rerun's SQL total covers every asset, not just the 50 in the CSV
+                        total_val = total_net_worth
                         
                         system_instruction = f"""
                         You are a helpful financial assistant. You have access to the user's portfolio data in CSV format below.
@@ -1610,20 +1899,7 @@ if not df.empty:
                         """
                         
                         with st.spinner("Thinking..."):
-                            # Use Llama 3.3 70B on Groq (Current versatile model)
-                            completion = client.chat.completions.create(
-                                model="llama-3.3-70b-versatile",
-                                messages=[
-                                    {"role": "system", "content": system_instruction},
-                                    {"role": "user", "content": prompt}
-                                ],
-                                temperature=0.5,
-                                max_tokens=1024,
-                                top_p=1,
-                                stream=False,
-                                stop=None,
-                            )
-                            answer = completion.choices[0].message.content
+                            answer = ask_groq(client, AI_CHAT_MODEL, system_instruction, prompt)
                         
                         with st.chat_message("assistant"):
                             st.markdown(answer)
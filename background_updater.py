@@ -1,8 +1,13 @@
 import time
 import datetime
+import functools
+import hashlib
+import heapq
 import pytz
+import numpy as np
 import yfinance as yf
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, Date, Text
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, Date, Text, select, func, case, event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import declarative_base, sessionmaker
 import logging
 import os
@@ -10,12 +15,24 @@ import requests
 from groq import Groq
 import sys
 import argparse
+import queue
+import threading
+from collections import namedtuple
+from market_data import run_parallel, download_closes
 
 # --- Configuration ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_FILE = os.getenv('DB_FILE_PATH', os.path.join(BASE_DIR, 'finance.db'))
 DATABASE_URL = f"sqlite:///{DB_FILE}"
 UK_TIMEZONE = pytz.timezone('Europe/London')
+UPDATE_INTERVAL = 3600 # seconds between updates while a market is open
+# Exchanges the portfolio trades on: (timezone, open, close) in exchange-local time, Mon-Fri.
+# Closes are padded by an hour so the run after the bell still records the closing price.
+MARKET_HOURS = [
+    (pytz.timezone('Asia/Kolkata'), datetime.time(9, 15), datetime.time(16, 30)),    # NSE/BSE, MF NAVs
+    (UK_TIMEZONE, datetime.time(8, 0), datetime.time(17, 30)),                       # LSE
+    (pytz.timezone('America/New_York'), datetime.time(9, 30), datetime.time(17, 0)), # NYSE/NASDAQ
+]
 
 # --- Database Setup ---
 Base = declarative_base()
@@ -23,15 +40,15 @@ Base = declarative_base()
 class Asset(Base):
     __tablename__ = 'assets'
     id = Column(Integer, primary_key=True)
-    owner = Column(String, nullable=False, default="Vivek")
+    owner = Column(String, nullable=False, default="Vivek", index=True)
     name = Column(String, nullable=False)
     dp_name = Column(String, nullable=True)
     asset_type = Column(String, nullable=False)
     currency = Column(String, nullable=False)
     quantity = Column(Float, nullable=False)
     unit_price = Column(Float, nullable=False)
-    isin = Column(String, nullable=True)
-    ticker = Column(String, nullable=True)
+    isin = Column(String, nullable=True, index=True)
+    ticker = Column(String, nullable=True, index=True)
     last_updated = Column(DateTime, nullable=True)
     daily_change_pct = Column(Float, nullable=True)
     original_unit_price = Column(Float, nullable=True)
@@ -58,7 +75,29 @@ class PortfolioChangeHistory(Base):
     monthly_change_value = Column(Float, nullable=True)
     monthly_change_percent = Column(Float, nullable=True)
 
-engine = create_engine(DATABASE_URL, connect_args={'timeout': 30})
+# A small long-lived pool: the hourly runs reuse the same connection (and its page cache)
+# instead of reopening the file. check_same_thread=False because the API also runs
+# update_prices in a worker thread.
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={'timeout': 30, 'check_same_thread': False},
+    pool_size=1,
+    max_overflow=2,
+    pool_pre_ping=True
+)
+
+# Per-connection pragmas, same as app.py/api.py: WAL + NORMAL sync so the hourly bulk update
+# doesn't block readers and fsyncs only at checkpoints
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL;")
+    cursor.execute("PRAGMA synchronous=NORMAL;")
+    cursor.execute("PRAGMA busy_timeout=30000;")
+    cursor.execute("PRAGMA temp_store=MEMORY;")
+    cursor.execute("PRAGMA cache_size=-64000;")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # --- Helpers ---
@@ -66,6 +105,24 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Format: { 'TICKER': last_notified_percentage }
 last_notified_prices = {} 
 last_total_change = None
+# (digest of the movers in the last AI summary, time.monotonic() it was sent)
+last_summary_digest = None
+SUMMARY_DEDUP_WINDOW = 30 * 60 # seconds
+# { 'TICKER': date price_30d was last refreshed by this process }. Tracked here rather than
+# via Asset.last_updated, which the app's Sync and the API also bump without touching price_30d
+price_30d_refreshed = {}
+
+# Groq client kept for the life of the process (rebuilt only if the key changes), so the
+# hourly AI calls reuse its HTTP connection instead of a new TLS handshake each time
+_groq_client = None
+_groq_key = None
+
+def get_groq_client(api_key):
+    global _groq_client, _groq_key
+    if _groq_client is None or api_key != _groq_key:
+        _groq_client = Groq(api_key=api_key)
+        _groq_key = api_key
+    return _groq_client
 
 def get_settings(session):
     return session.query(AppSettings).filter(AppSettings.id == 1).first()
@@ -85,10 +142,51 @@ def send_gotify_alert(title, message, settings):
             }
         }
     }
-    try:
-        requests.post(url, json=payload, timeout=10)
-    except Exception as e:
-        print(f"Error sending Gotify: {e}")
+    # Queued for the sender thread so the update loop never waits on Gotify
+    _start_gotify_sender()
+    _gotify_queue.put((url, payload))
+
+# Gotify pushes go through one daemon thread and one keep-alive session
+GOTIFY_RETRIES = 3
+_gotify_queue = queue.Queue()
+_gotify_session = requests.Session()
+_gotify_sender = None
+_gotify_sender_lock = threading.Lock()
+
+def _gotify_sender_loop():
+    while True:
+        url, payload = _gotify_queue.get()
+        try:
+            for attempt in range(GOTIFY_RETRIES):
+                try:
+                    response = _gotify_session.post(url, json=payload, timeout=10)
+                    # Only server errors are worth retrying; a bad token won't fix itself
+                    if response.status_code < 500:
+                        if not response.ok:
+                            print(f"Error sending Gotify: HTTP {response.status_code}")
+                        break
+                    error = f"HTTP {response.status_code}"
+                except requests.RequestException as e:
+                    error = e
+                if attempt + 1 < GOTIFY_RETRIES:
+                    time.sleep(2 ** attempt) # 1s, 2s backoff
+                else:
+                    print(f"Error sending Gotify: {error}")
+        finally:
+            _gotify_queue.task_done()
+
+def _start_gotify_sender():
+    global _gotify_sender
+    with _gotify_sender_lock:
+        if _gotify_sender is None:
+            _gotify_sender = threading.Thread(target=_gotify_sender_loop, name="gotify-sender", daemon=True)
+            _gotify_sender.start()
+
+def flush_gotify_alerts(timeout=30):
+    """Waits (up to timeout seconds) for queued pushes to go out; for callers about to exit."""
+    deadline = time.monotonic() + timeout
+    while _gotify_queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.1)
 
 def analyze_and_notify(session, assets):
     """
@@ -96,22 +194,22 @@ def analyze_and_notify(session, assets):
     ONLY if the summary has changed significantly or total portfolio moved > 0.5%
     or individual stock crossed the threshold.
     """
-    global last_notified_prices, last_total_change
+    global last_notified_prices, last_total_change, last_summary_digest
     
     settings = get_settings(session)
     if not settings or not settings.groq_api_key or not settings.gotify_enabled:
         return
 
     # 1. Calculate Total Portfolio Change
-    total_val = 0.0
-    total_change_val = 0.0
-    
-    for a in assets:
-        val = a.quantity * a.unit_price
-        total_val += val
-        if a.daily_change_pct is not None:
-            prev_val = val / (1 + (a.daily_change_pct / 100))
-            total_change_val += (val - prev_val)
+    # Vectorised over all assets; a missing daily % counts as no change
+    n = len(assets)
+    vals = np.fromiter((a.quantity for a in assets), dtype=np.float64, count=n)
+    vals *= np.fromiter((a.unit_price for a in assets), dtype=np.float64, count=n)
+    pct = np.fromiter((np.nan if a.daily_change_pct is None else a.daily_change_pct for a in assets), dtype=np.float64, count=n)
+    pct = np.nan_to_num(pct, nan=0.0)
+    total_val = float(vals.sum())
+    # val - val / (1 + pct/100) == val * pct / (100 + pct)
+    total_change_val = float((vals * pct / (100.0 + pct)).sum())
             
     total_change_pct = (total_change_val / (total_val - total_change_val)) * 100 if (total_val - total_change_val) > 0 else 0.0
     
@@ -172,23 +270,38 @@ def analyze_and_notify(session, assets):
         return
 
     # 3. Generate AI Summary
-    sorted_assets = sorted([a for a in assets if a.daily_change_pct is not None], key=lambda x: x.daily_change_pct, reverse=True)
-    top_gainers = sorted_assets[:5]
-    top_losers = sorted_assets[-5:]
+    # Only the top/bottom 5 are needed, so select them without sorting every asset
+    priced_assets = [a for a in assets if a.daily_change_pct is not None]
+    change_key = lambda x: x.daily_change_pct
+    top_gainers = heapq.nlargest(5, priced_assets, key=change_key)
+    # Listed best-first after the gainers, as before
+    top_losers = heapq.nsmallest(5, priced_assets, key=change_key)[::-1]
+    gainer_ids = {id(a) for a in top_gainers}
+
+    # The movers (to 0.1%) are the actual signal: if they match the last summary sent within
+    # the window, skip the Groq call and the push instead of comparing generated prose
+    digest = hashlib.blake2b(
+        "|".join(f"{a.ticker}:{a.daily_change_pct:.1f}" for a in top_gainers + top_losers).encode(),
+        digest_size=16
+    ).hexdigest()
+    now = time.monotonic()
+    if last_summary_digest and last_summary_digest[0] == digest and now - last_summary_digest[1] < SUMMARY_DEDUP_WINDOW:
+        print("Skipping notification: same movers as the last summary.")
+        return
     
     context_lines = [f"Total Portfolio Change: {total_change_pct:+.2f}%"]
     context_lines.append("Asset | Price | Change %")
     for a in top_gainers:
         context_lines.append(f"{a.name} ({a.ticker}) | {a.unit_price:.2f} | +{a.daily_change_pct:.2f}%")
     for a in top_losers:
-        if a not in top_gainers:
+        if id(a) not in gainer_ids:
             context_lines.append(f"{a.name} ({a.ticker}) | {a.unit_price:.2f} | {a.daily_change_pct:.2f}%")
             
     data_str = "\n".join(context_lines)
     prompt = f"Analyze these stock price movements:\n\n{data_str}\n\nTask:\n1. Identify significant fluctuations.\n2. Write a concise, 2-3 sentence summary for a push notification.\n3. If flat, say 'Market is quiet.'\n4. Give only the summary."
     
     try:
-        client = Groq(api_key=settings.groq_api_key)
+        client = get_groq_client(settings.groq_api_key)
         completion = client.chat.completions.create(
             model="llama-3.3-70b-versatile",
             messages=[{"role": "user", "content": prompt}],
@@ -203,72 +316,124 @@ def analyze_and_notify(session, assets):
         full_message += "🏠 [Web UI](http://172.23.177.144:8502/)"
             
         send_gotify_alert("📉 Market Update", full_message, settings)
+        last_summary_digest = (digest, now)
         print(f"Sent AI Notification: {summary}")
     except Exception as e:
         print(f"AI Analysis Failed: {e}")
 
+@functools.lru_cache(maxsize=32)
+def _fx_rate_cached(from_currency, date_key):
+    # date_key only partitions the cache: each pair is fetched at most once per day per process.
+    # Failures raise, so a 1.0 fallback is never cached.
+    pair = "GBPINR=X" if from_currency == 'GBp' else f"{from_currency}INR=X"
+    return float(yf.Ticker(pair).history(period="1d")['Close'].iloc[-1])
+
 def get_exchange_rate(from_currency):
     if from_currency == 'INR': return 1.0
-    if from_currency == 'GBp':
-        try:
-            return yf.Ticker("GBPINR=X").history(period="1d")['Close'].iloc[-1]
-        except: return 1.0
     try:
-        return yf.Ticker(f"{from_currency}INR=X").history(period="1d")['Close'].iloc[-1]
-    except: return 1.0
+        return _fx_rate_cached(from_currency, datetime.date.today())
+    except Exception: return 1.0
+
+# Currencies converted to INR on every update; the pairs are fetched with the price batch
+FX_PAIRS = {'USD': 'USDINR=X', 'GBP': 'GBPINR=X', 'EUR': 'EURINR=X'}
+
+def fetch_quote(symbol):
+    """
+    Last price, previous close and currency for one symbol from fast_info (a single light quote
+    request) rather than .info, which scrapes the full quoteSummary.
+    """
+    fi = yf.Ticker(symbol).fast_info
+    return {'price': fi.last_price, 'prev_close': fi.previous_close, 'currency': fi.currency}
 
 # --- Update Logic ---
+# What analyze_and_notify reads for each asset updated in this run, built in the price loop
+MovedAsset = namedtuple('MovedAsset', 'name ticker quantity unit_price daily_change_pct')
+# Totals over every asset: current value, today's change (price - price / (1 + pct/100), written
+# as price * pct / (100 + pct)), and the 30-day change/base for assets with a 30d price
+_HAS_30D = Asset.price_30d > 0
+PORTFOLIO_TOTALS_QUERY = select(
+    func.coalesce(func.sum(Asset.quantity * Asset.unit_price), 0.0),
+    func.coalesce(func.sum(Asset.quantity * Asset.unit_price * Asset.daily_change_pct / (100.0 + Asset.daily_change_pct)), 0.0),
+    func.coalesce(func.sum(case((_HAS_30D, (Asset.unit_price - Asset.price_30d) * Asset.quantity))), 0.0),
+    func.coalesce(func.sum(case((_HAS_30D, Asset.price_30d * Asset.quantity))), 0.0),
+)
+
 def update_prices():
     print(f"[{datetime.datetime.now()}] Starting Price Update...")
     session = SessionLocal()
     
     try:
-        assets = session.query(Asset).filter(Asset.ticker.isnot(None)).all()
+        # Plain rows with just the columns the loop reads: no ORM objects to build or track
+        assets = session.execute(
+            select(Asset.id, Asset.name, Asset.ticker, Asset.quantity, Asset.original_currency, Asset.daily_change_pct,
+                   Asset.price_30d)
+            .where(Asset.ticker.isnot(None))
+        ).all()
         updated_count = 0
-        updated_assets_for_ai = []
+        # The same pass also builds the notifier's input, so nothing is re-read after the commit
+        moved_assets = []
+        # Price changes are collected here and written in one executemany UPDATE after the loop
+        price_updates = []
         
-        rates_cache = { 'INR': 1.0, 'USD': get_exchange_rate('USD'), 'GBP': get_exchange_rate('GBP'), 'EUR': get_exchange_rate('EUR') }
+        # Batched downloads cover every ticker and the FX pairs. The 30d reference only moves once
+        # a day and is stored on the asset, so the 40-day window is fetched just for symbols whose
+        # price_30d wasn't refreshed today (failed lookups are retried on the next run); the hourly
+        # runs after that only need the last few closes.
+        symbols = sorted({a.ticker.strip() for a in assets if a.ticker and a.ticker.strip()})
+        today = datetime.date.today()
+        need_30d = sorted({
+            a.ticker.strip() for a in assets
+            if a.ticker and a.ticker.strip() and (a.price_30d is None or price_30d_refreshed.get(a.ticker.strip()) != today)
+        })
+        need_30d_set = set(need_30d)
+        refreshed_30d = set()
+        closes = download_closes(need_30d, period="40d")
+        closes.update(download_closes([s for s in symbols if s not in need_30d_set] + list(FX_PAIRS.values()), period="5d"))
+
+        # The remaining per-symbol calls are network-bound, so they overlap on a bounded pool
+        # before the loop: .info for symbols missing from the batch, and the currency (which
+        # rarely changes, so the stored one is reused) for batch symbols never priced before
+        infos = run_parallel(fetch_quote, [s for s in symbols if s not in closes])
+        need_currency = sorted({a.ticker.strip() for a in assets if not a.original_currency} & closes.keys())
+        currencies = run_parallel(lambda s: yf.Ticker(s).fast_info.get('currency', 'INR'), need_currency)
+
+        rates_cache = {'INR': 1.0}
+        for cur, pair in FX_PAIRS.items():
+            fx_close = closes.get(pair)
+            rates_cache[cur] = float(fx_close.iloc[-1]) if fx_close is not None else get_exchange_rate(cur)
 
         for asset in assets:
             if not asset.ticker or not asset.ticker.strip(): continue
+            symbol = asset.ticker.strip()
             try:
-                ticker = yf.Ticker(asset.ticker)
-                
                 # --- 1. Get Current Price (Robust) ---
                 today_price = None
                 prev_close_price = None
-                currency = 'INR' # Default
+                currency = asset.original_currency or currencies.get(symbol, (None, None))[0]
 
-                # Try getting fast history first (like app.py)
-                try:
-                    hist_short = ticker.history(period="5d")
-                    if not hist_short.empty:
-                        today_price = hist_short['Close'].iloc[-1]
-                        if len(hist_short) >= 2:
-                            prev_close_price = hist_short['Close'].iloc[-2]
-                except Exception as e:
-                    print(f"Short history failed for {asset.ticker}: {e}")
-
-                # Fallback to info if history fails
+                # Last two closes from the batch download
+                close = closes.get(symbol)
+                if close is not None:
+                    today_price = float(close.iloc[-1])
+                    if len(close) >= 2:
+                        prev_close_price = float(close.iloc[-2])
+
+                # Fallback to info if the symbol was missing from the batch
                 if today_price is None:
-                    try:
-                        info = ticker.info
-                        today_price = info.get('currentPrice') or info.get('regularMarketPrice')
-                        prev_close_price = info.get('previousClose') or info.get('regularMarketPreviousClose')
-                        currency = info.get('currency', 'INR')
-                    except Exception as e:
-                        print(f"Info fallback failed for {asset.ticker}: {e}")
+                    info, error = infos.get(symbol, (None, None))
+                    if error:
+                        print(f"Info fallback failed for {asset.ticker}: {error}")
+                    info = info or {}
+                    today_price = info.get('price')
+                    prev_close_price = info.get('prev_close')
+                    currency = currency or info.get('currency')
 
                 if today_price is None:
                     print(f"Skipping {asset.ticker}: No price found.")
                     continue
 
                 # --- 2. Update Asset Price ---
-                # Attempt to get currency from history metadata if not set
-                if currency == 'INR':
-                    try:
-                        currency = ticker.fast_info.get('currency', 'INR')
-                    except: pass
+                currency = currency or 'INR'
 
                 # Currency Conversion
                 native_price = today_price
@@ -279,51 +444,50 @@ def update_prices():
                 elif currency != 'INR':
                     price_inr = native_price * rates_cache.get(currency, 1.0)
 
-                asset.unit_price = price_inr
-                asset.original_unit_price = native_price
-                asset.original_currency = currency
-                asset.last_updated = datetime.datetime.now()
+                row = {
+                    'id': asset.id,
+                    'unit_price': price_inr,
+                    'original_unit_price': native_price,
+                    'original_currency': currency,
+                    'last_updated': datetime.datetime.now(),
+                }
                 
                 if prev_close_price and prev_close_price > 0:
-                    asset.daily_change_pct = ((today_price - prev_close_price) / prev_close_price) * 100
-
-                # --- 3. Get 30d History (Best Effort) ---
-                try:
-                    hist_long = ticker.history(period="40d")
-                    if not hist_long.empty:
-                        target_date = datetime.date.today() - datetime.timedelta(days=30)
-                        # Find closest date
-                        closest_date = min(hist_long.index, key=lambda d: abs(d.date() - target_date))
-                        # Only use if reasonably close (within 5 days)
-                        if abs((closest_date.date() - target_date).days) < 5:
-                            asset.price_30d = hist_long.loc[closest_date]['Close']
-                except Exception as e:
-                    # Do not fail the update if 30d history fails
-                    print(f"30d history check failed for {asset.ticker}: {e}")
+                    row['daily_change_pct'] = ((today_price - prev_close_price) / prev_close_price) * 100
+
+                # --- 3. Get 30d Price (Best Effort, from the 40d download; otherwise the stored one stands) ---
+                if close is not None and symbol in need_30d_set:
+                    target_date = today - datetime.timedelta(days=30)
+                    # Find closest date: the index is sorted, so binary-search and compare the two neighbours
+                    # (exchange-local calendar days, hence dropping the tz before truncating to days)
+                    index = close.index.tz_localize(None) if close.index.tz is not None else close.index
+                    days = index.values.astype('datetime64[D]')
+                    target = np.datetime64(target_date, 'D')
+                    pos = int(np.searchsorted(days, target))
+                    lo, hi = max(pos - 1, 0), min(pos, len(days) - 1)
+                    nearest = lo if abs(days[lo] - target) <= abs(days[hi] - target) else hi
+                    # Only use if reasonably close (within 5 days)
+                    if abs(days[nearest] - target) < np.timedelta64(5, 'D'):
+                        row['price_30d'] = float(close.to_numpy()[nearest])
+                        refreshed_30d.add(symbol)
                 
-                updated_assets_for_ai.append(asset)
+                price_updates.append(row)
+                moved_assets.append(MovedAsset(
+                    asset.name, asset.ticker, asset.quantity, price_inr,
+                    # Without a previous close the stored % is kept, as the UPDATE leaves it as is
+                    row.get('daily_change_pct', asset.daily_change_pct)
+                ))
                 updated_count += 1
             except Exception as e:
                 print(f"Error updating {asset.ticker}: {e}")
 
+        # One executemany UPDATE (grouped by which columns each row sets) instead of a flush per asset
+        if price_updates:
+            session.bulk_update_mappings(Asset, price_updates)
+
         # --- Calculate & Store Portfolio Changes ---
-        total_value = 0
-        total_daily_change_value = 0
-        total_monthly_change_value = 0
-        total_value_30d_ago = 0
-        
-        all_updated_assets = session.query(Asset).all() # Re-fetch all assets to get a complete picture
-        for asset in all_updated_assets:
-            current_val = asset.quantity * asset.unit_price
-            total_value += current_val
-
-            if asset.daily_change_pct is not None:
-                prev_price = asset.unit_price / (1 + (asset.daily_change_pct / 100))
-                total_daily_change_value += (asset.unit_price - prev_price) * asset.quantity
-            
-            if asset.price_30d is not None and asset.price_30d > 0:
-                total_monthly_change_value += (asset.unit_price - asset.price_30d) * asset.quantity
-                total_value_30d_ago += asset.price_30d * asset.quantity
+        # Aggregated by SQLite over all assets (including the rows just updated) in one query
+        total_value, total_daily_change_value, total_monthly_change_value, total_value_30d_ago = session.execute(PORTFOLIO_TOTALS_QUERY).one()
 
         yesterday_total_value = total_value - total_daily_change_value
         daily_pct = (total_daily_change_value / yesterday_total_value) * 100 if yesterday_total_value else 0
@@ -331,30 +495,27 @@ def update_prices():
 
         # Upsert into history table
         today = datetime.date.today()
-        change_record = session.query(PortfolioChangeHistory).filter_by(date=today).first()
-        if change_record:
-            change_record.daily_change_value = total_daily_change_value
-            change_record.daily_change_percent = daily_pct
-            change_record.monthly_change_value = total_monthly_change_value
-            change_record.monthly_change_percent = monthly_pct
-        else:
-            change_record = PortfolioChangeHistory(
-                date=today,
-                daily_change_value=total_daily_change_value,
-                daily_change_percent=daily_pct,
-                monthly_change_value=total_monthly_change_value,
-                monthly_change_percent=monthly_pct
-            )
-            session.add(change_record)
+        change_values = dict(
+            daily_change_value=total_daily_change_value,
+            daily_change_percent=daily_pct,
+            monthly_change_value=total_monthly_change_value,
+            monthly_change_percent=monthly_pct
+        )
+        # Native INSERT ... ON CONFLICT(date) DO UPDATE instead of a lookup followed by update/add
+        session.execute(
+            sqlite_insert(PortfolioChangeHistory)
+            .values(date=today, **change_values)
+            .on_conflict_do_update(index_elements=['date'], set_=change_values)
+        )
         
         print(f"[{datetime.datetime.now()}] Logged portfolio changes for {today}.")
 
         session.commit()
         print(f"Updated {updated_count} assets.")
+        price_30d_refreshed.update(dict.fromkeys(refreshed_30d, today))
         
         if updated_count > 0:
-            settings = get_settings(session)
-            analyze_and_notify(session, updated_assets_for_ai)
+            analyze_and_notify(session, moved_assets)
             
     except Exception as e:
         print(f"Update Loop Error: {e}")
@@ -362,11 +523,37 @@ def update_prices():
     finally:
         session.close()
 
+def seconds_until_market_open(now=None):
+    """
+    0 if any tracked market is open (weekday, inside its padded hours), otherwise the
+    seconds until the earliest next open, so the loop doesn't poll stale prices overnight/weekends.
+    """
+    now = now or datetime.datetime.now(pytz.utc)
+    next_open = None
+    for tz, open_t, close_t in MARKET_HOURS:
+        local = now.astimezone(tz)
+        if local.weekday() < 5 and open_t <= local.time() < close_t:
+            return 0
+        for days in range(8):
+            day = local.date() + datetime.timedelta(days=days)
+            if day.weekday() >= 5:
+                continue
+            candidate = tz.localize(datetime.datetime.combine(day, open_t))
+            if candidate > now:
+                if next_open is None or candidate < next_open:
+                    next_open = candidate
+                break
+    return max(0, int((next_open - now).total_seconds())) if next_open else UPDATE_INTERVAL
+
 def main_loop():
-    print("Background Price Updater Started. Schedule: Every 60 minutes.")
+    print("Background Price Updater Started. Schedule: Every 60 minutes while a market is open.")
     update_prices() # Run once on start
     while True:
-        time.sleep(3600)
+        time.sleep(UPDATE_INTERVAL)
+        wait = seconds_until_market_open()
+        if wait:
+            print(f"[{datetime.datetime.now(UK_TIMEZONE)}] Markets closed, next update in {wait / 3600:.1f}h.")
+            time.sleep(wait)
         update_prices()
 
 if __name__ == "__main__":
@@ -376,5 +563,7 @@ if __name__ == "__main__":
     
     if args.once:
         update_prices()
+        # The sender is a daemon thread; let queued pushes out before the process exits
+        flush_gotify_alerts()
     else:
         main_loop()
\ No newline at end of file
@@ -2,13 +2,16 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import sqlalchemy
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, event
 from sqlalchemy.orm import declarative_base, sessionmaker
 import pandas as pd
+import numpy as np
 import datetime
 import yfinance as yf
 import os
 import sys
+import requests
+from market_data import run_parallel, download_last_closes
 
 # --- DATABASE SETUP ---
 # Use absolute path to ensure cron/task scheduler finds the DB correctly
@@ -21,15 +24,15 @@ Base = declarative_base()
 class Asset(Base):
     __tablename__ = 'assets'
     id = Column(Integer, primary_key=True)
-    owner = Column(String, nullable=False, default="Vivek")
+    owner = Column(String, nullable=False, default="Vivek", index=True)
     name = Column(String, nullable=False)
     dp_name = Column(String, nullable=True)
     asset_type = Column(String, nullable=False)
     currency = Column(String, nullable=False)
     quantity = Column(Float, nullable=False)
     unit_price = Column(Float, nullable=False)
-    isin = Column(String, nullable=True)
-    ticker = Column(String, nullable=True)
+    isin = Column(String, nullable=True, index=True)
+    ticker = Column(String, nullable=True, index=True)
     last_updated = Column(DateTime, nullable=True)
     original_currency = Column(String, nullable=True)
     original_unit_price = Column(Float, nullable=True)
@@ -39,7 +42,7 @@ class Asset(Base):
 class PortfolioHistory(Base):
     __tablename__ = 'portfolio_history'
     id = Column(Integer, primary_key=True)
-    date = Column(Date, nullable=False)
+    date = Column(Date, nullable=False, index=True)
     total_value = Column(Float, nullable=False)
 
 class AppSettings(Base):
@@ -59,6 +62,20 @@ class AppSettings(Base):
     groq_api_key = Column(String, nullable=True)
 
 engine = create_engine(DATABASE_URL, connect_args={'timeout': 30})
+
+# Per-connection pragmas, same as app.py/background_updater.py: WAL + NORMAL sync so the
+# price commit doesn't fsync on every write or block the app's readers
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL;")
+    cursor.execute("PRAGMA synchronous=NORMAL;")
+    cursor.execute("PRAGMA busy_timeout=30000;")
+    cursor.execute("PRAGMA temp_store=MEMORY;")
+    cursor.execute("PRAGMA cache_size=-64000;")
+    cursor.execute("PRAGMA mmap_size=268435456;")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # --- LOGIC ---
@@ -140,11 +157,10 @@ def get_ai_summary(data, config):
         return None
 
 def send_gotify(data, config, ai_summary=None):
+    """Pushes the report to Gotify. Returns None on success, otherwise the error message."""
     if not config.get('GOTIFY_ENABLED') or not config.get('GOTIFY_URL') or not config.get('GOTIFY_TOKEN'):
-        return
+        return "Gotify is not configured."
 
-    import requests
-    
     title = f"Daily Report: ₹ {data['net_worth']:,.0f} ({data['change_pct']:+.2f}%)"
     
     # Simple markdown message
@@ -187,92 +203,114 @@ def send_gotify(data, config, ai_summary=None):
         resp = requests.post(url, json=payload, timeout=10)
         if resp.status_code == 200:
             print("Gotify notification sent successfully!")
-        else:
-            print(f"Failed to send Gotify notification: {resp.status_code} - {resp.text}")
+            return None
+        error = f"Failed to send Gotify notification: {resp.status_code} - {resp.text}"
     except Exception as e:
-        print(f"Error sending Gotify notification: {e}")
+        error = f"Error sending Gotify notification: {e}"
+    print(error)
+    return error
+
+# One keep-alive session shared by the parallel Yahoo searches
+yahoo_session = requests.Session()
+yahoo_session.headers.update({'User-Agent': 'Mozilla/5.0'})
 
 def resolve_ticker_from_yahoo(query):
-    import requests # Ensure requests is available locally if not global
     url = f"https://query2.finance.yahoo.com/v1/finance/search?q={query}"
-    headers = {'User-Agent': 'Mozilla/5.0'}
     try:
-        r = requests.get(url, headers=headers, timeout=5)
+        r = yahoo_session.get(url, timeout=5)
         if r.status_code == 200:
             data = r.json()
             quotes = data.get('quotes', [])
             if not quotes: return None
             for q in quotes:
                 symbol = q.get('symbol', '')
-                if symbol.endswith('.NS') or symbol.endswith('.BO'):
+                if symbol.endswith(('.NS', '.BO')):
                     return symbol
             return quotes[0].get('symbol')
     except Exception:
         return None
     return None
 
+def fetch_quote(symbol):
+    """
+    (last price, previous close) from fast_info: one light quote request instead of the
+    full quoteSummary scrape behind .info.
+    """
+    fi = yf.Ticker(symbol).fast_info
+    return fi.last_price, fi.previous_close
+
 def update_prices_headless():
     """Updates prices without UI interaction."""
     session = SessionLocal()
-    # Fetch assets with ticker OR isin
-    assets = session.query(Asset).filter((Asset.ticker.isnot(None)) | (Asset.isin.isnot(None))).all()
+    # Fetch assets with ticker OR isin (plain rows; writes go through one bulk update below)
+    assets = session.execute(
+        sqlalchemy.select(Asset.id, Asset.name, Asset.ticker, Asset.isin)
+        .where((Asset.ticker.isnot(None)) | (Asset.isin.isnot(None)))
+    ).all()
     print(f"Updating prices for {len(assets)} assets...")
-    
-    updated_count = 0
-    for asset in assets:
-        # Auto-resolve Ticker if missing but ISIN exists
-        if (not asset.ticker or not asset.ticker.strip()) and asset.isin:
-            print(f"Attempting to resolve ticker for ISIN: {asset.isin} ({asset.name})")
-            found_ticker = resolve_ticker_from_yahoo(asset.isin)
+
+    symbols = {a.id: (a.ticker or '').strip() for a in assets}
+    mappings = {}
+
+    # Auto-resolve Ticker if missing but ISIN exists (searches run concurrently, once per ISIN)
+    unresolved = [a for a in assets if not symbols[a.id] and a.isin]
+    if unresolved:
+        print(f"Attempting to resolve tickers for {len(unresolved)} assets by ISIN...")
+        resolved = run_parallel(resolve_ticker_from_yahoo, sorted({a.isin for a in unresolved}))
+        for asset in unresolved:
+            found_ticker = resolved[asset.isin][0]
             if found_ticker:
-                print(f"Found ticker: {found_ticker}")
-                asset.ticker = found_ticker
-                session.commit()
-            else:
-                continue # Skip if still no ticker
+                print(f"Found ticker for {asset.name}: {found_ticker}")
+                symbols[asset.id] = found_ticker.strip()
+                mappings[asset.id] = {'id': asset.id, 'ticker': found_ticker}
 
-        if asset.ticker and asset.ticker.strip():
+    # One batched download for every ticker instead of a history() round-trip per asset
+    tickers = sorted({t for t in symbols.values() if t})
+    closes = download_last_closes(tickers)
+    # Quotes for tickers missing from the batch, fetched concurrently before the loop
+    infos = run_parallel(fetch_quote, [t for t in tickers if t not in closes])
+
+    updated_count = 0
+    now = datetime.datetime.now()
+    for asset in assets:
+        symbol = symbols[asset.id]
+        if symbol:
             try:
-                ticker = yf.Ticker(asset.ticker)
-                price = None
-                prev_close = None
-                
-                hist = ticker.history(period="5d")
-                if not hist.empty:
-                    price = hist['Close'].iloc[-1]
-                    if len(hist) >= 2:
-                        prev_close = hist['Close'].iloc[-2]
+                price, prev_close = closes.get(symbol, (None, None))
                 
+                # Fallback to a single quote only for tickers missing from the batch download
                 if not price:
-                    info = ticker.info
-                    price = info.get('currentPrice') or info.get('regularMarketPrice')
-                    prev_close = info.get('previousClose') or info.get('regularMarketPreviousClose')
+                    quote, error = infos[symbol]
+                    if error: raise error
+                    price, prev_close = quote
 
                 if price and price > 0:
-                    asset.unit_price = price
-                    asset.last_updated = datetime.datetime.now()
+                    row = mappings.setdefault(asset.id, {'id': asset.id})
+                    row['unit_price'] = price
+                    row['last_updated'] = now
                     
                     if prev_close and prev_close > 0:
-                        change = ((price - prev_close) / prev_close) * 100
-                        asset.daily_change_pct = change
+                        row['daily_change_pct'] = ((price - prev_close) / prev_close) * 100
                     updated_count += 1
             except Exception as e:
-                print(f"Failed to update {asset.ticker}: {e}")
-                
+                print(f"Failed to update {symbol}: {e}")
+
+    # Single executemany UPDATE keyed on id, bypassing per-object change tracking
+    if mappings:
+        session.bulk_update_mappings(Asset, list(mappings.values()))
     session.commit()
     session.close()
     print(f"Updated {updated_count} assets.")
 
+# Read straight through the module engine; Value (INR) is computed by SQLite alongside the row
+PORTFOLIO_QUERY = sqlalchemy.select(Asset, (Asset.quantity * Asset.unit_price).label('Value (INR)'))
+HISTORY_QUERY = sqlalchemy.select(PortfolioHistory)
+
 def get_portfolio_data():
-    engine = create_engine(DATABASE_URL, connect_args={'timeout': 30})
-    df = pd.read_sql(sessionmaker(bind=engine)().query(Asset).statement, sessionmaker(bind=engine)().bind)
-    if not df.empty:
-        df['Value (INR)'] = df['quantity'] * df['unit_price']
-    return df
+    return pd.read_sql(PORTFOLIO_QUERY, engine)
 
 def get_history_data():
-    engine = create_engine(DATABASE_URL, connect_args={'timeout': 30})
-    return pd.read_sql(sessionmaker(bind=engine)().query(PortfolioHistory).statement, sessionmaker(bind=engine)().bind)
+    return pd.read_sql(HISTORY_QUERY, engine)
 
 def generate_report():
     update_prices_headless()
@@ -282,7 +320,7 @@ def generate_report():
         return None, None
 
     # --- Net Worth & Change ---
-    total_net_worth = df['Value (INR)'].sum()
+    total_net_worth = float(df['Value (INR)'].to_numpy(dtype=np.float64).sum())
     
     # Calculate History Change
     hist_df = get_history_data()
@@ -340,11 +378,15 @@ def generate_report():
     session.close()
 
     # --- Highlights (Aggregated Family View) ---
-    highlights_df = df.copy()
+    # df is local to this report, so the derived columns go straight onto it (no copy)
+    highlights_df = df
     
-    # 1. Calculate per-row value change
-    highlights_df['prev_price_est'] = highlights_df['unit_price'] / (1 + (highlights_df['daily_change_pct'].fillna(0) / 100))
-    highlights_df['daily_change_value'] = (highlights_df['unit_price'] - highlights_df['prev_price_est']) * highlights_df['quantity']
+    # 1. Calculate per-row value change in one array expression:
+    # price - price / (1 + pct/100) == price * pct / (100 + pct); unknown % counts as no change
+    pct = highlights_df['daily_change_pct'].fillna(0).to_numpy(dtype=np.float64)
+    up = highlights_df['unit_price'].to_numpy(dtype=np.float64)
+    qty = highlights_df['quantity'].to_numpy(dtype=np.float64)
+    highlights_df['daily_change_value'] = up * pct / (100.0 + pct) * qty
     
     # 2. Normalize Ticker
     highlights_df['ticker'] = highlights_df['ticker'].fillna('').str.strip().str.upper()
@@ -398,6 +440,7 @@ def format_price(amount, currency):
     return f"{symbol}{amount:,.2f}"
 
 def send_email(data, config, ai_summary=None):
+    """Emails the HTML report. Returns None on success, otherwise the error message."""
     msg = MIMEMultipart("alternative")
     msg['Subject'] = f"Daily Portfolio Report: ₹ {data['net_worth']:,.0f} ({data['change_pct']:+.2f}%)"
     msg['From'] = config['SENDER_EMAIL']
@@ -517,33 +560,59 @@ def send_email(data, config, ai_summary=None):
             server.login(config['SENDER_EMAIL'], config['SENDER_PASSWORD'])
             server.sendmail(config['SENDER_EMAIL'], config['RECEIVER_EMAIL'], msg.as_string())
         print("Email sent successfully!")
+        return None
     except Exception as e:
-        print(f"Error sending email: {e}")
+        error = f"Error sending email: {e}"
+        print(error)
+        return error
 
-if __name__ == "__main__":
-    print("Generating Daily Report...")
+def send_report():
+    """
+    Builds the daily report and sends it to every configured channel (email and/or Gotify).
+    Returns a short status message; raises RuntimeError if settings or channels are missing,
+    or if any configured channel failed to deliver.
+    """
     config = get_settings()
     
     if not config:
-        print("❌ Settings not found.")
-        sys.exit(1)
+        raise RuntimeError("Settings not found.")
         
     # Check if at least one notification method is configured
     email_configured = config.get('SENDER_EMAIL') and config.get('SENDER_PASSWORD')
     gotify_configured = config.get('GOTIFY_ENABLED') and config.get('GOTIFY_URL') and config.get('GOTIFY_TOKEN')
     
     if not email_configured and not gotify_configured:
-        print("❌ Configuration needed: Please configure Email OR Gotify in 'Settings'.")
-        sys.exit(1)
+        raise RuntimeError("Configuration needed: Please configure Email OR Gotify in 'Settings'.")
         
     data = generate_report()
-    if data:
-        # Generate AI Summary
-        ai_summary = get_ai_summary(data, config)
-        
-        if email_configured:
-            send_email(data, config, ai_summary)
-        if gotify_configured:
-            send_gotify(data, config, ai_summary)
-    else:
-        print("No data found to generate report.")
+    if not data:
+        return "No data found to generate report."
+
+    # Generate AI Summary
+    ai_summary = get_ai_summary(data, config)
+    
+    channels, errors = [], []
+    if email_configured:
+        error = send_email(data, config, ai_summary)
+        if error:
+            errors.append(error)
+        else:
+            channels.append("email")
+    if gotify_configured:
+        error = send_gotify(data, config, ai_summary)
+        if error:
+            errors.append(error)
+        else:
+            channels.append("Gotify")
+    if errors:
+        sent = f"Report sent via {' and '.join(channels)}, but " if channels else ""
+        raise RuntimeError(sent + "delivery failed: " + "; ".join(errors))
+    return f"Report sent via {' and '.join(channels)}."
+
+if __name__ == "__main__":
+    print("Generating Daily Report...")
+    try:
+        print(send_report())
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
@@ -68,6 +68,21 @@ def run_migration():
              except Exception as e:
                 print(f"Error adding quantity_change: {e}")
 
+        # 4. Indexes for owner/ticker/ISIN lookups and date-ordered history reads
+        indexes = [
+            ("ix_assets_owner", "assets", "owner"),
+            ("ix_assets_ticker", "assets", "ticker"),
+            ("ix_assets_isin", "assets", "isin"),
+            ("ix_portfolio_history_date", "portfolio_history", "date"),
+            ("ix_investment_transactions_date", "investment_transactions", "date"),
+        ]
+        
+        for name, table, col in indexes:
+            try:
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({col})"))
+            except Exception as e:
+                print(f"Error creating index {name}: {e}")
+
         conn.commit()
         print("Database schema check complete.")
 
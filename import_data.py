@@ -15,15 +15,15 @@ Base = declarative_base()
 class Asset(Base):
     __tablename__ = 'assets'
     id = Column(Integer, primary_key=True)
-    owner = Column(String, nullable=False, default="Vivek")
+    owner = Column(String, nullable=False, default="Vivek", index=True)
     name = Column(String, nullable=False)
     dp_name = Column(String, nullable=True) 
     asset_type = Column(String, nullable=False)
     currency = Column(String, nullable=False)
     quantity = Column(Float, nullable=False)
     unit_price = Column(Float, nullable=False)
-    isin = Column(String, nullable=True)
-    ticker = Column(String, nullable=True)
+    isin = Column(String, nullable=True, index=True)
+    ticker = Column(String, nullable=True, index=True)
     last_updated = Column(DateTime, nullable=True)
 
 engine = create_engine(DATABASE_URL, connect_args={'timeout': 30})
@@ -56,14 +56,21 @@ def guess_ticker(name, isin):
             return f"{first_word}.NS"
     return None
 
-import shutil
+import sqlite3
 import time
 
 def backup_database():
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     backup_file = f"{DB_FILE}.{timestamp}.bak"
     try:
-        shutil.copy2(DB_FILE, backup_file)
+        # Online backup API: consistent copy of the live database, including WAL pages
+        src_conn = sqlite3.connect(DB_FILE)
+        dst_conn = sqlite3.connect(backup_file)
+        try:
+            src_conn.backup(dst_conn)
+        finally:
+            dst_conn.close()
+            src_conn.close()
         print(f"Database backup created: {backup_file}")
         return True
     except Exception as e:
@@ -0,0 +1,78 @@
+import yfinance as yf
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Yahoo helpers shared by app.py, background_updater.py and daily_email_report.py
+
+# Concurrent Yahoo requests per run_parallel call; more than this mostly earns HTTP 429s
+MAX_NETWORK_WORKERS = 8
+# yf.download is given at most this many symbols per call
+DOWNLOAD_CHUNK_SIZE = 20
+
+def progress_step(total):
+    # Each progress update may be a UI round-trip, so loops report about every 5% instead of every item
+    return max(1, total // 20)
+
+def run_parallel(fn, items, on_progress=None):
+    """
+    Runs fn(item) for each item on a bounded thread pool (the calls are network-bound, so they overlap).
+    Returns {item: (result, error)}; one failure doesn't stop the rest. Workers only fetch, so all
+    DB writes stay on the caller's thread. on_progress(done, total) is called from the calling
+    thread about every 5% of items.
+    """
+    results = {}
+    total = len(items)
+    if not total:
+        return results
+    step = progress_step(total)
+    with ThreadPoolExecutor(max_workers=min(MAX_NETWORK_WORKERS, total)) as pool:
+        futures = {pool.submit(fn, item): item for item in items}
+        for done, future in enumerate(as_completed(futures), start=1):
+            item = futures[future]
+            try:
+                results[item] = (future.result(), None)
+            except Exception as e:
+                results[item] = (None, e)
+            if on_progress and (done % step == 0 or done == total): on_progress(done, total)
+    return results
+
+def download_closes(symbols, period="5d"):
+    """
+    Fetches daily closes for all symbols with one yf.download call per DOWNLOAD_CHUNK_SIZE symbols.
+    Returns {symbol: Close series without gaps}; symbols with no data are left out.
+    """
+    closes = {}
+    symbols = list(symbols)
+    for start in range(0, len(symbols), DOWNLOAD_CHUNK_SIZE):
+        chunk = symbols[start:start + DOWNLOAD_CHUNK_SIZE]
+        try:
+            data = yf.download(chunk, period=period, group_by='ticker', threads=True, progress=False, auto_adjust=False)
+        except Exception as e:
+            print(f"Batch price download failed: {e}")
+            continue
+        if data is None or data.empty:
+            continue
+
+        for symbol in chunk:
+            try:
+                if data.columns.nlevels > 1:
+                    if symbol not in data.columns.get_level_values(0):
+                        continue
+                    close = data[symbol]['Close'].dropna()
+                else:
+                    # Older yfinance returns flat columns for a single ticker
+                    close = data['Close'].dropna()
+            except KeyError:
+                continue
+            if not close.empty:
+                closes[symbol] = close
+    return closes
+
+def download_last_closes(symbols):
+    """
+    The last two daily closes for all symbols, via download_closes.
+    Returns {symbol: (price, prev_close)}; prev_close is None with a single close.
+    """
+    return {
+        symbol: (float(close.iloc[-1]), float(close.iloc[-2]) if len(close) >= 2 else None)
+        for symbol, close in download_closes(symbols).items()
+    }